@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Log analyzer benchmark """
+
+import os
+import gzip
+import json
+import time
+import queue
+import random
+import sys
+import shutil
+import logging
+import argparse
+import datetime
+import resource
+import tempfile
+import multiprocessing
+
+from log_analyzer import gen_parse_log, parse_line_regex, generate_report, \
+    calc_time, write_report, new_aggregate, AggregateSpec
+from readers import gen_log_lines
+
+
+STAGES = ['parse', 'parse_regex', 'generate_report', 'calc_time', 'write_report']
+# seconds between checks that the stage process is still alive
+POLL_INTERVAL = 1
+
+METHODS = ['GET'] * 8 + ['POST', 'HEAD']
+STATUSES = [200] * 17 + [301, 404, 500]
+AGENTS = ['-', 'Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5',
+          'python-requests/2.13.0', 'Mozilla/5.0 (Windows NT 6.1; WOW64)']
+BROKEN_LINES = [
+    '1.194.135.240 -  - [29/Jun/2017:03:50:23 +0300] "0" 400 166 "-" "-" "-" "-" "-" 0.000',
+    '1.168.65.96 -  - [29/Jun/2017:03:50:24 +0300] "-" 400 0 "-" "-" "-" "-" "-" 0.001',
+    '1.99.174.176 3b81f63526fa8  - [29/Jun/2017:03:50:25 +0300] "GET /api/1/',
+]
+
+REPORT_TEMPLATE = '<html><script>var table = $table_json;</script></html>'
+
+
+def gen_log_lines_synthetic(lines, urls, error_ratio, seed=0):
+    """ Generator, return deterministic ui_short log lines,
+    url ids are log-uniform over urls distinct urls, so low ids are hot """
+
+    rnd = random.Random(seed)
+    moment = datetime.datetime(2017, 6, 29, 3, 50, 22)
+
+    for number in range(lines):
+        moment += datetime.timedelta(milliseconds=rnd.randrange(50))
+        if rnd.random() < error_ratio:
+            yield rnd.choice(BROKEN_LINES) + '\n'
+            continue
+
+        url_id = int(urls ** rnd.random()) - 1
+        url = '/api/v2/banner/{}'.format(url_id)
+        if url_id % 3 == 0:
+            url += '?server_name=WIN7RB{}'.format(url_id % 7)
+
+        yield '{}.{}.{}.{} {}  - [{}] "{} {} HTTP/1.1" {} {} "-" "{}" "-" ' \
+            '"{}-{}" "{}" {:.3f}\n'.format(
+                rnd.randrange(1, 256), rnd.randrange(256), rnd.randrange(256),
+                rnd.randrange(256), rnd.choice(['-', '3b81f63526fa8']),
+                moment.strftime('%d/%b/%Y:%H:%M:%S +0300'), rnd.choice(METHODS),
+                url, rnd.choice(STATUSES), rnd.randrange(20000),
+                rnd.choice(AGENTS), number, rnd.randrange(10 ** 9),
+                rnd.choice(['-', 'dc7161be3']), rnd.expovariate(5))
+
+
+def generate_log(log_path, lines, urls, error_ratio, seed=0):
+    """ Write synthetic log, gzipped if log_path ends with .gz """
+
+    opener = gzip.open if log_path.endswith('.gz') else open
+    with opener(log_path, 'wt', encoding='utf-8') as file:
+        file.writelines(gen_log_lines_synthetic(lines, urls, error_ratio, seed))
+
+
+def max_rss_mb():
+    """ Return peak RSS of this process so far, Linux reports it in kilobytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stage(stage, log_path, options):
+    """ Run stage once and return its measurements,
+    data the stage consumes is prepared before the timer starts
+    and setup_rss_mb is the peak RSS of that preparation """
+
+    spec = AggregateSpec(options.get('exact', False))
+    lines = 0
+
+    if stage == 'calc_time':
+        aggregate = new_aggregate(AggregateSpec(True))
+        for record in gen_parse_log(log_path):
+            aggregate.add(record)
+        urls = aggregate.urls
+        total_count = aggregate.total_count
+        total_time = aggregate.total_time
+    elif stage == 'generate_report':
+        log_lines = sum(1 for _ in gen_log_lines(log_path))
+    elif stage == 'write_report':
+        report = generate_report(log_path, gen_parse_log, spec)
+        report_dir = tempfile.mkdtemp()
+        with open(report_dir + '/report.html', 'w') as file:
+            file.write(REPORT_TEMPLATE)
+        cfg = {'REPORT_DIR': report_dir, 'REPORT_SIZE': options.get('report_size', 1000)}
+
+    setup_rss = max_rss_mb()
+    started, cpu_started = time.perf_counter(), time.process_time()
+
+    if stage == 'parse':
+        for _ in gen_parse_log(log_path):
+            lines += 1
+    elif stage == 'parse_regex':
+        for line in gen_log_lines(log_path):
+            parse_line_regex(line)
+            lines += 1
+    elif stage == 'generate_report':
+        generate_report(log_path, gen_parse_log, spec,
+                        workers=options.get('workers', 1),
+                        report_size=options.get('report_size'),
+                        use_numpy=options.get('numpy', False))
+        lines = log_lines
+    elif stage == 'calc_time':
+        for url, times in urls.items():
+            calc_time(url, times, total_time, total_count)
+        lines = len(urls)
+    elif stage == 'write_report':
+        write_report(cfg, report, cfg['REPORT_DIR'] + '/report-bench.html')
+        lines = len(report)
+    else:
+        raise ValueError(f'Unknown stage {stage}')
+
+    seconds = time.perf_counter() - started
+    if stage == 'write_report':
+        shutil.rmtree(cfg['REPORT_DIR'])
+
+    return {
+        "stage": stage,
+        "items": lines,
+        "seconds": seconds,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "items_per_sec": lines / seconds if seconds else None,
+        "setup_rss_mb": setup_rss}
+
+
+def _stage_process(stage, log_path, options, results):
+    """ Process, run stage and put result with peak RSS to results,
+    stage_rss_mb is how much the stage raised the peak over its setup """
+
+    result = run_stage(stage, log_path, options)
+    result['peak_rss_mb'] = max_rss_mb()
+    result['stage_rss_mb'] = result['peak_rss_mb'] - result['setup_rss_mb']
+    results.put(result)
+
+
+def measure_stage(stage, log_path, options):
+    """ Run stage in a fresh process so peak RSS isn't left over from other
+    stages, it includes the stage setup though, see run_stage.
+    Raise RuntimeError if the process dies without a result """
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_stage_process,
+                              args=(stage, log_path, options, results))
+    process.start()
+    try:
+        while True:
+            try:
+                result = results.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+            # the result may have been put right before the exit
+            try:
+                result = results.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                raise RuntimeError(f'Stage {stage} process exited with code '
+                                   f'{process.exitcode} without result')
+    finally:
+        process.join()
+    return result
+
+
+def run_benchmark(args):
+    """ Generate log if needed, measure every stage and return results """
+
+    log_path = args.log
+    if not log_path:
+        log_path = os.path.join(tempfile.mkdtemp(), 'nginx-access-ui.log-20170630' +
+                                ('.gz' if args.gzip else ''))
+        logging.info(f'Generating {args.lines} lines log {log_path}')
+        generate_log(log_path, args.lines, args.urls, args.errors, args.seed)
+
+    options = {"workers": args.workers, "exact": args.exact,
+               "report_size": args.report_size, "numpy": args.numpy}
+    results = {
+        "log": log_path,
+        "log_size": os.path.getsize(log_path),
+        "options": options,
+        "stages": []}
+
+    for stage in args.stages:
+        logging.info(f'Running {stage}')
+        try:
+            result = measure_stage(stage, log_path, options)
+        except RuntimeError as exc:
+            logging.error(exc)
+            result = {"stage": stage, "error": str(exc)}
+        logging.info(result)
+        results['stages'].append(result)
+
+    return results
+
+
+def get_args_from_cli():
+    """ Return arguments from CLI """
+
+    parser = argparse.ArgumentParser("python3 bench.py")
+    parser.add_argument('--log', help='Existing log to benchmark on')
+    parser.add_argument('--lines', type=int, default=1000000,
+                        help='Lines in generated log')
+    parser.add_argument('--urls', type=int, default=100000,
+                        help='Distinct urls in generated log')
+    parser.add_argument('--errors', type=float, default=0.001,
+                        help='Ratio of broken lines in generated log')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Generate gzipped log')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--exact', action='store_true')
+    parser.add_argument('--numpy', action='store_true',
+                        help='Calculate exact report with NumPy')
+    parser.add_argument('--report-size', type=int, default=1000)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--output', help='JSON file for results, stdout by default')
+    return parser.parse_args()
+
+
+def main():
+
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+
+    args = get_args_from_cli()
+    results = run_benchmark(args)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    if any('error' in result for result in results['stages']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
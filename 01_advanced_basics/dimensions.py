@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+""" Report dimensions aggregated in the same pass as per-url times """
+
+import logging
+import datetime
+
+from stats import TimeSketch
+
+
+# $time_local prefix up to minutes, e.g. 29/Jun/2017:03:50
+MINUTE_KEY_LENGTH = 17
+MINUTE_KEY_FORMAT = '%d/%b/%Y:%H:%M'
+
+
+def parse_minute(minute):
+    """ Return datetime of minute key or None if it isn't one """
+    try:
+        return datetime.datetime.strptime(minute, MINUTE_KEY_FORMAT)
+    except ValueError:
+        return None
+
+
+class StatusDimension(object):
+    """ Requests count by $status """
+
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, entry):
+        self.counts[entry.status] = self.counts.get(entry.status, 0) + 1
+
+    def merge(self, other):
+        for status, count in other.counts.items():
+            self.counts[status] = self.counts.get(status, 0) + count
+        return self
+
+    def report(self):
+        total = sum(self.counts.values())
+        return [{"status": status,
+                 "count": count,
+                 "count_perc": count/total*100}
+                for status, count in sorted(self.counts.items())]
+
+    def dump(self):
+        return sorted(self.counts.items())
+
+    @classmethod
+    def load(cls, data):
+        dimension = cls()
+        dimension.counts = {status: count for status, count in data}
+        return dimension
+
+
+class LatencyDimension(object):
+    """ Request times histogram (TimeSketch) by minute of $time_local,
+    minutes are kept as $time_local prefixes and parsed once when first seen.
+    Entries with $time_local that isn't a time are counted and skipped """
+
+    def __init__(self):
+        self.minutes = {}
+        self.invalid_count = 0
+
+    def add(self, entry):
+        minute = entry.time_local[:MINUTE_KEY_LENGTH]
+        stats = self.minutes.get(minute)
+        if stats is None:
+            if parse_minute(minute) is None:
+                self.invalid_count += 1
+                return
+            stats = self.minutes[minute] = TimeSketch()
+        stats.add(entry.time)
+
+    def merge(self, other):
+        for minute, stats in other.minutes.items():
+            if minute not in self.minutes:
+                self.minutes[minute] = stats
+            else:
+                self.minutes[minute].merge(stats)
+        self.invalid_count += other.invalid_count
+        return self
+
+    def report(self):
+        if self.invalid_count:
+            logging.warning(f'Latency dimension skipped {self.invalid_count} '
+                            f'entries with invalid $time_local')
+        minutes = {parse_minute(minute): stats for minute, stats in self.minutes.items()}
+        return [{"minute": minute.isoformat(),
+                 "count": stats.count,
+                 "time_avg": stats.sum/stats.count,
+                 "time_max": stats.max,
+                 "time_med": stats.quantile(0.5),
+                 "time_p90": stats.quantile(0.9),
+                 "time_p99": stats.quantile(0.99)}
+                for minute, stats in sorted(minutes.items())]
+
+    def dump(self):
+        return {"minutes": {minute: stats.dump() for minute, stats in self.minutes.items()},
+                "invalid_count": self.invalid_count}
+
+    @classmethod
+    def load(cls, data):
+        if "minutes" not in data:
+            # dump of older versions holds minutes only
+            data = {"minutes": data, "invalid_count": 0}
+        dimension = cls()
+        dimension.minutes = {minute: TimeSketch.load(stats)
+                             for minute, stats in data["minutes"].items()
+                             if parse_minute(minute) is not None}
+        dimension.invalid_count = data["invalid_count"]
+        return dimension
+
+
+class BytesDimension(object):
+    """ $body_bytes_sent totals """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, entry):
+        self.count += 1
+        self.sum += entry.bytes_sent
+        if entry.bytes_sent > self.max:
+            self.max = entry.bytes_sent
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        return self
+
+    def report(self):
+        return {"count": self.count,
+                "bytes_sum": self.sum,
+                "bytes_avg": self.sum/self.count if self.count else 0,
+                "bytes_max": self.max}
+
+    def dump(self):
+        return [self.count, self.sum, self.max]
+
+    @classmethod
+    def load(cls, data):
+        dimension = cls()
+        dimension.count, dimension.sum, dimension.max = data
+        return dimension
+
+
+DIMENSIONS = {
+    'status': StatusDimension,
+    'latency': LatencyDimension,
+    'bytes': BytesDimension,
+}
@@ -6,13 +6,31 @@ import os
 import re
 import gzip
 import glob
+import signal
 import argparse
 import datetime
 import json
+import heapq
+import cProfile
 import logging
-from collections import namedtuple
+import threading
+from array import array
+from collections import namedtuple, deque
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 from string import Template
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stats import TimeList, TimeArray, TimeSketch
+from readers import gen_log_lines, gen_windows, gen_mapped_lines, is_compressed
+from dimensions import DIMENSIONS
+from metrics import run_metrics
+
 
 # log_format ui_short '$remote_addr  $remote_user $http_x_real_ip [$time_local] "$request" '
 #                     '$status $body_bytes_sent "$http_referer" '
@@ -24,17 +42,33 @@ config = {
     "REPORT_DIR": "/home/user/OTUS/reports",
     "LOG_DIR": "/home/user/OTUS/log",
     "ERROR_LIMIT": 1,
+    "WORKERS": 1,
+    "EXACT": False,
+    "INCREMENTAL": False,
+    "URL_RULES": [],
+    "STRIP_QUERY": False,
+    "TOP_URLS": 0,
+    "ERROR_RATE": 0.2,
+    "SAMPLE_LINES": 1000,
+    "WATCH_INTERVAL": 60,
+    "DIMENSIONS": [],
+    "NUMPY": False,
 }
 DEFAULT_CONFIG = './config.json'
 
+# lines per task sent to a worker when the log can't be split by bytes (compressed)
+LOG_BATCH_LINES = 50000
+# lines parsed between checks of the share of broken lines
+ERROR_CHECK_LINES = 10000
+
 log_record_pattern = re.compile(r"""
                 ^(\d+\.\d+\.\d+\.\d+)\s+            # $remote_addr
                 (.+?)\s+                            # $remote_user
                 (.+?)\s+                            # $http_x_real_ip
-                (\[.+?\])\s+                        # [$time_local]
+                \[(?P<time_local>.+?)\]\s+          # [$time_local]
                 (\"\S+\s+(?P<url>\S+)\s+\S+\")\s+   # "$request"
-                (\d{1,3})\s+                        # $status
-                (\d+)\s+                            # $body_bytes_sent
+                (?P<status>\d{1,3})\s+              # $status
+                (?P<bytes_sent>\d+)\s+              # $body_bytes_sent
                 (\".+?\")\s+                        # "$http_referer"
                 (\".+?\")\s+                        # "$http_user_agent"
                 (\".+?\")\s+                        # "$http_x_forwarded_for"
@@ -43,12 +77,67 @@ log_record_pattern = re.compile(r"""
                 (?P<request_time>\d+\.?\d*)$        # $request_time
                 """, re.VERBOSE)
 
+# the structure log_record_pattern matches, but on bytes and in a single way:
+# ascii fields before "$request", five non-empty quoted fields without quotes
+# inside and single spaces after "$request"
+fast_line_pattern = re.compile(rb"""
+                \d+\.\d+\.\d+\.\d+\ +[!#-~]+\ +[!#-~]+\ +                   # $remote_addr $remote_user $http_x_real_ip
+                \[([!#-~]+(?:\ +[!#-~]+)*)\]\ +"                            # [$time_local]
+                [!#-~]+\ +([^\s"]+)\ +[!#-~]+"                              # "$request"
+                \ (\d{1,3})\ (\d+)                                          # $status $body_bytes_sent
+                (?:\ "[^"\n]+"){5}                                          # quoted fields
+                \ (\d+(?:\.\d*)?)\n?\Z                                      # $request_time
+                """, re.VERBOSE)
+
+# url and $request_time of a line of fast_line_pattern structure with
+# ascii-only url. Every match spans a whole line,
+# group 'url' is None if the line needs parse_line
+mapped_line_pattern = re.compile(rb"""
+                (?:\d+\.\d+\.\d+\.\d+\ +[!#-~]+\ +[!#-~]+\ +                # $remote_addr $remote_user $http_x_real_ip
+                \[[!#-~]+(?:\ +[!#-~]+)*\]\ +"                              # [$time_local]
+                [!#-~]+\ +(?P<url>[!#-~]+)\ +[!#-~]+"                       # "$request"
+                \ \d{1,3}\ \d+                                              # $status $body_bytes_sent
+                (?:\ "[^"\n]+"){5}                                          # quoted fields
+                \ (?P<request_time>\d+(?:\.\d*)?)(?=\n)                     # $request_time
+                )?.*\n
+                """, re.VERBOSE)
+
 log_name_pattern = re.compile(
-    r"^(nginx-access-ui\.log-)(?P<date>\d{4}\d{2}\d{2})(.gz)?$")
+    r"^(nginx-access-ui\.log-)(?P<date>\d{4}\d{2}\d{2})(\.gz|\.bz2|\.xz)?$")
 
 
 Log = namedtuple('Log', 'path date')
 LogRecord = namedtuple('LogRecord', 'url time')
+# line fields needed by report dimensions
+LogEntry = namedtuple('LogEntry', 'url time status bytes_sent time_local')
+
+
+def parse_log_name(directory, file):
+    """ Return (path, date) of log file or None if it's not a log """
+
+    match = log_name_pattern.search(file)
+    if not match:
+        return None
+
+    try:
+        current_date = datetime.datetime.strptime(
+            match.group('date'), '%Y%m%d').date()
+    except ValueError:
+        logging.exception('Can\'t parse log file date')
+        raise ValueError
+
+    return Log('/'.join([directory, file]), current_date)
+
+
+def gen_logs(directory):
+    """ Generator, return (path, date) of every log in directory """
+
+    filenames = os.listdir(directory)
+
+    for file in filenames:
+        log = parse_log_name(directory, file)
+        if log:
+            yield log
 
 
 def get_last_log(directory):
@@ -57,43 +146,680 @@ def get_last_log(directory):
 
     last_log = Log(None, None)
 
-    filenames = os.listdir(directory)
+    for log in gen_logs(directory):
+        if not last_log.date or log.date > last_log.date:
+            last_log = log
 
-    for file in filenames:
-        match = log_name_pattern.search(file)
-        if match:
+    return last_log
+
+
+class LogIndex(object):
+    """ Logs of directory seen so far for long-running watch mode.
+    Directory is scanned again only when its mtime changes,
+    and every file name is parsed once """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.mtime = None
+        self.logs = {}
+
+    def scan(self):
+        """ Update index if directory has changed, return True if it has """
+
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+
+        logs = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name in self.logs:
+                    logs[entry.name] = self.logs[entry.name]
+                else:
+                    logs[entry.name] = parse_log_name(self.directory, entry.name)
+        self.logs = logs
+        return True
+
+    def get_last_log(self):
+        """ Return (path, date) last log like get_last_log does """
+
+        last_log = Log(None, None)
+        for log in self.logs.values():
+            if log and (not last_log.date or log.date > last_log.date):
+                last_log = log
+        return last_log
+
+
+def get_logs(directory, date_from=None, date_to=None):
+    """ Return list of (path, date) logs in directory between
+    date_from and date_to inclusive, ordered by date """
+
+    logs = [log for log in gen_logs(directory)
+            if (not date_from or log.date >= date_from) and
+            (not date_to or log.date <= date_to)]
+
+    return sorted(logs, key=lambda log: log.date)
+
+
+def parse_line_regex(line):
+    """ Return LogRecord from raw log line or None if line doesn't match """
+
+    match = log_record_pattern.search(line.decode('utf-8'))
+    if not match:
+        return None
+
+    return LogRecord(match.group('url'), float(match.group('request_time')))
+
+
+def split_line_fast(line):
+    """ Return (time_local, url, status, bytes_sent, request_time) raw fields
+    of ui_short log line matched by fast_line_pattern, only url is decoded.
+    Return None if line can't be handled this way """
+
+    match = fast_line_pattern.match(line)
+    if not match:
+        return None
+    time_local, url, status, bytes_sent, time = match.groups()
+    try:
+        url = url.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    # non-ascii whitespace splits "$request" for log_record_pattern
+    if not url.isprintable():
+        return None
+    return time_local, url, status, bytes_sent, time
+
+
+def parse_line_fast(line):
+    """ Return LogRecord from raw ui_short log line split by split_line_fast.
+    Return None if line can't be handled this way """
+
+    fields = split_line_fast(line)
+    if not fields:
+        return None
+    return LogRecord(fields[1], float(fields[4]))
+
+
+def parse_line(line):
+    """ Return LogRecord from raw log line or None if line doesn't match,
+    regex is used only for lines the fast parser can't handle """
+
+    return parse_line_fast(line) or parse_line_regex(line)
+
+
+def parse_entry_regex(line):
+    """ Return LogEntry from raw log line or None if line doesn't match """
+
+    match = log_record_pattern.search(line.decode('utf-8'))
+    if not match:
+        return None
+
+    return LogEntry(match.group('url'), float(match.group('request_time')),
+                    int(match.group('status')), int(match.group('bytes_sent')),
+                    match.group('time_local'))
+
+
+def parse_entry_fast(line):
+    """ Return LogEntry from raw ui_short log line split by split_line_fast.
+    Return None if line can't be handled this way """
+
+    fields = split_line_fast(line)
+    if not fields:
+        return None
+    time_local, url, status, bytes_sent, time = fields
+    return LogEntry(url, float(time), int(status), int(bytes_sent), time_local.decode('ascii'))
+
+
+def parse_entry(line):
+    """ Return LogEntry from raw log line or None if line doesn't match """
+
+    return parse_entry_fast(line) or parse_entry_regex(line)
+
+
+def gen_parse_mapped(log_path, start=0, end=None, live=False):
+    """ Generator, return LogRecord or None for every line of plain log
+    in [start, end). The log is mapped read-only and scanned window by window
+    with mapped_line_pattern, so only url and time are copied out of it,
+    lines the pattern doesn't handle go to parse_line.
+    A live log is read instead of mapped, see gen_read_windows """
+
+    for buffer, start, end in gen_windows(log_path, start, end, live):
+        for match in mapped_line_pattern.finditer(buffer, start, end):
+            url, time = match.groups()
+            if url is None:
+                yield parse_line(match.group())
+                continue
             try:
-                current_date = datetime.datetime.strptime(
-                    match.group('date'), '%Y%m%d').date()
-            except ValueError:
-                logging.exception('Can\'t parse log file date')
-                raise ValueError
+                url = url.decode('utf-8')
+            except UnicodeDecodeError:
+                yield parse_line(match.group())
+                continue
+            yield LogRecord(url, float(time))
+
+        # the last line of the log has no line break
+        if buffer[end - 1] != ord('\n'):
+            last_line = max(buffer.rfind(b'\n', start, end) + 1, start)
+            yield parse_line(buffer[last_line:end])
+
+
+def gen_parse_log(log_path, entries=False, live=False):
+    """ Generator, Reading log and return data,
+    LogEntry instead of LogRecord if entries,
+    live plain log may still be written or truncated meanwhile """
+
+    if not is_compressed(log_path):
+        if entries:
+            yield from map(parse_entry, gen_mapped_lines(log_path, live=live))
+        else:
+            yield from gen_parse_mapped(log_path, live=live)
+        run_metrics.count('bytes_read', os.path.getsize(log_path))
+        return
 
-            if not last_log.date or current_date > last_log.date:
-                abs_path = '/'.join([directory, file])
-                last_log = Log(abs_path, current_date)
+    parse = parse_entry if entries else parse_line
+    for line in gen_log_lines(log_path):
+        yield parse(line)
 
-    return last_log
 
+class UrlNormalizer(object):
+    """ Rewrites url by precompiled (pattern, replacement) rules,
+    e.g. numeric ids to {id}, and optionally strips query string """
+
+    def __init__(self, rules=(), strip_query=False):
+        self.rules = [[pattern, replacement] for pattern, replacement in rules]
+        self.strip_query = strip_query
+        self.patterns = [(re.compile(pattern), replacement)
+                         for pattern, replacement in self.rules]
+
+    def __call__(self, url):
+        if self.strip_query:
+            url = url.partition('?')[0]
+        for pattern, replacement in self.patterns:
+            url = pattern.sub(replacement, url)
+        return url
+
+
+# live log may still be written or truncated while it's parsed,
+# so it's read instead of mapped, it doesn't change the aggregate
+AggregateSpec = namedtuple('AggregateSpec',
+                           'exact normalizer top_urls error_rate dimensions live',
+                           defaults=(False, None, 0, None, (), False))
+
+
+class ErrorRateExceeded(ValueError):
+    """ Share of lines not matching the log format is over the limit """
+
+
+class LogAggregate(object):
+    """ Request times statistics grouped by url for a whole log or a part of it,
+    exact keeps every request time (TimeList) instead of TimeSketch """
+
+    normalize = None
+    evicted_count = 0
+    evicted_time = 0
+
+    def __init__(self, exact=False):
+        self.exact = exact
+        self.stats_type = TimeList if exact else TimeSketch
+        self.urls = {}
+        self.errors_count = 0
+
+    def add(self, record):
+        if not record:
+            self.errors_count += 1
+            return
+        url = record.url if self.normalize is None else self.normalize(record.url)
+        stats = self.urls.get(url)
+        if stats is None:
+            stats = self.urls[url] = self.stats_type()
+        stats.add(record.time)
+
+    def merge(self, other):
+        """ Append other aggregate, which must follow this one in the log """
+        for url, stats in other.urls.items():
+            if url not in self.urls:
+                self.urls[url] = stats
+            else:
+                self.urls[url].merge(stats)
+        self.errors_count += other.errors_count
+        return self
+
+    @property
+    def total_count(self):
+        return sum(stats.count for stats in self.urls.values()) + self.evicted_count
+
+    @property
+    def total_time(self):
+        return sum(stats.sum for stats in self.urls.values()) + self.evicted_time
+
+    def dump(self):
+        """ Return JSON serializable representation """
+        return {
+            "exact": self.exact,
+            "errors_count": self.errors_count,
+            "urls": {url: stats.dump() for url, stats in self.urls.items()}}
+
+    @classmethod
+    def load(cls, data):
+        aggregate = cls(data['exact'])
+        aggregate.errors_count = data['errors_count']
+        aggregate.urls = {url: aggregate.stats_type.load(stats)
+                          for url, stats in data['urls'].items()}
+        return aggregate
+
+
+class HeavyHittersAggregate(LogAggregate):
+    """ LogAggregate tracking at most capacity urls (Space-Saving).
+    When it's full, the url with the smallest estimated time_sum is evicted
+    and its estimate becomes the error of the new url. Every url with
+    time_sum over total_time / capacity is guaranteed to be tracked and
+    its time_sum is underestimated by at most its error """
+
+    def __init__(self, capacity, exact=False):
+        super(HeavyHittersAggregate, self).__init__(exact)
+        self.capacity = capacity
+        self.errors = {}
+        self.heap = []
+        self.evicted_count = 0
+        self.evicted_time = 0
+
+    def estimate(self, url):
+        return self.urls[url].sum + self.errors.get(url, 0)
+
+    def evict(self):
+        """ Drop url with the smallest estimate and return the estimate,
+        heap entries only grow stale upwards, so they are refreshed lazily """
+        while True:
+            estimate, url = heapq.heappop(self.heap)
+            current = self.estimate(url)
+            if current > estimate:
+                heapq.heappush(self.heap, (current, url))
+                continue
+            stats = self.urls.pop(url)
+            self.errors.pop(url, None)
+            self.evicted_count += stats.count
+            self.evicted_time += stats.sum
+            return current
+
+    def add(self, record):
+        if not record:
+            self.errors_count += 1
+            return
+        url = record.url if self.normalize is None else self.normalize(record.url)
+        stats = self.urls.get(url)
+        if stats is None:
+            error = self.evict() if len(self.urls) >= self.capacity else 0
+            stats = self.urls[url] = self.stats_type()
+            if error:
+                self.errors[url] = error
+            heapq.heappush(self.heap, (error, url))
+        stats.add(record.time)
+
+    def min_estimate(self):
+        """ Return the smallest estimate of a full summary, an url it doesn't
+        track may have been evicted with time_sum up to it, 0 if not full """
+        if len(self.urls) < self.capacity:
+            return 0
+        return min(self.estimate(url) for url in self.urls)
+
+    def merge(self, other):
+        """ Merge other aggregate, errors of both summaries add up,
+        an url missing in one of them gets its min_estimate as error too """
+        self_min, other_min = self.min_estimate(), other.min_estimate()
+        for url, stats in other.urls.items():
+            error = other.errors.get(url, 0)
+            if url not in self.urls:
+                self.urls[url] = stats
+                error += self_min
+            else:
+                self.urls[url].merge(stats)
+                error += self.errors.get(url, 0)
+            if error:
+                self.errors[url] = error
+        if other_min:
+            for url in self.urls:
+                if url not in other.urls:
+                    self.errors[url] = self.errors.get(url, 0) + other_min
+        self.errors_count += other.errors_count
+        self.evicted_count += other.evicted_count
+        self.evicted_time += other.evicted_time
+
+        self.heap = [(self.estimate(url), url) for url in self.urls]
+        heapq.heapify(self.heap)
+        while len(self.urls) > self.capacity:
+            self.evict()
+        return self
+
+    def dump(self):
+        data = super(HeavyHittersAggregate, self).dump()
+        data.update({
+            "capacity": self.capacity,
+            "errors": self.errors,
+            "evicted": [self.evicted_count, self.evicted_time]})
+        return data
+
+    @classmethod
+    def load(cls, data):
+        aggregate = cls(data['capacity'], data['exact'])
+        aggregate.errors_count = data['errors_count']
+        aggregate.urls = {url: aggregate.stats_type.load(stats)
+                          for url, stats in data['urls'].items()}
+        aggregate.errors = data['errors']
+        aggregate.evicted_count, aggregate.evicted_time = data['evicted']
+        aggregate.heap = [(aggregate.estimate(url), url) for url in aggregate.urls]
+        heapq.heapify(aggregate.heap)
+        return aggregate
+
+
+class CompactAggregate(object):
+    """ Every request time of a log or a part of it kept in flat arrays,
+    urls are interned to integer ids, so there are no per-request objects """
+
+    exact = True
+    normalize = None
+    evicted_count = 0
+    evicted_time = 0
+
+    def __init__(self):
+        self.ids = {}
+        self.url_ids = array('I')
+        self.times = array('d')
+        self.errors_count = 0
+
+    def add(self, record):
+        if not record:
+            self.errors_count += 1
+            return
+        url = record.url if self.normalize is None else self.normalize(record.url)
+        url_id = self.ids.get(url)
+        if url_id is None:
+            url_id = self.ids[url] = len(self.ids)
+        self.url_ids.append(url_id)
+        self.times.append(record.time)
+
+    def merge(self, other):
+        """ Append other aggregate, which must follow this one in the log """
+        remap = array('I', (self.ids.setdefault(url, len(self.ids))
+                            for url in other.ids))
+        self.url_ids.extend(remap[url_id] for url_id in other.url_ids)
+        self.times.extend(other.times)
+        self.errors_count += other.errors_count
+        return self
+
+    @property
+    def urls(self):
+        """ Return request times grouped by url in log order """
+        groups = [TimeArray() for _ in range(len(self.ids))]
+        for url_id, time in zip(self.url_ids, self.times):
+            groups[url_id].append(time)
+        return dict(zip(self.ids, groups))
+
+    @property
+    def total_count(self):
+        return len(self.times)
+
+    @property
+    def total_time(self):
+        return sum(stats.sum for stats in self.urls.values())
+
+    def dump(self):
+        """ Return JSON serializable representation """
+        return {
+            "exact": True,
+            "compact": True,
+            "errors_count": self.errors_count,
+            "urls": list(self.ids),
+            "url_ids": self.url_ids.tolist(),
+            "times": self.times.tolist()}
+
+    @classmethod
+    def load(cls, data):
+        aggregate = cls()
+        aggregate.errors_count = data['errors_count']
+        aggregate.ids = {url: url_id for url_id, url in enumerate(data['urls'])}
+        aggregate.url_ids = array('I', data['url_ids'])
+        aggregate.times = array('d', data['times'])
+        return aggregate
+
+
+class MultiAggregate(object):
+    """ Per-url aggregate and report dimensions (see dimensions.DIMENSIONS)
+    fed from the same LogEntry records, so every dimension costs no extra pass """
+
+    def __init__(self, aggregate, dimensions):
+        self.aggregate = aggregate
+        self.dimensions = dimensions
+
+    def add(self, entry):
+        self.aggregate.add(entry)
+        if entry:
+            for dimension in self.dimensions.values():
+                dimension.add(entry)
+
+    def merge(self, other):
+        self.aggregate.merge(other.aggregate)
+        for name, dimension in self.dimensions.items():
+            dimension.merge(other.dimensions[name])
+        return self
+
+    @property
+    def exact(self):
+        return self.aggregate.exact
+
+    @property
+    def urls(self):
+        return self.aggregate.urls
+
+    @property
+    def errors_count(self):
+        return self.aggregate.errors_count
+
+    @property
+    def evicted_count(self):
+        return self.aggregate.evicted_count
+
+    @property
+    def evicted_time(self):
+        return self.aggregate.evicted_time
+
+    @property
+    def total_count(self):
+        return self.aggregate.total_count
+
+    @property
+    def total_time(self):
+        return self.aggregate.total_time
+
+    def dump(self):
+        """ Return JSON serializable representation """
+        return {
+            "aggregate": self.aggregate.dump(),
+            "dimensions": {name: dimension.dump()
+                           for name, dimension in self.dimensions.items()}}
+
+
+def new_aggregate(spec=AggregateSpec()):
+    """ Return empty aggregate for spec: exact keeps every request time
+    compactly, top_urls limits the number of tracked urls,
+    normalizer rewrites urls before aggregation,
+    dimensions are aggregated along with urls """
+
+    if spec.top_urls:
+        aggregate = HeavyHittersAggregate(spec.top_urls, spec.exact)
+    elif spec.exact:
+        aggregate = CompactAggregate()
+    else:
+        aggregate = LogAggregate()
+    aggregate.normalize = spec.normalizer
+    if spec.dimensions:
+        aggregate = MultiAggregate(aggregate, {name: DIMENSIONS[name]()
+                                               for name in spec.dimensions})
+    return aggregate
+
+
+def load_aggregate(data, spec=AggregateSpec()):
+    """ Return aggregate from its dump() """
+
+    if 'dimensions' in data:
+        return MultiAggregate(load_aggregate(data['aggregate'], spec),
+                              {name: DIMENSIONS[name].load(dimension)
+                               for name, dimension in data['dimensions'].items()})
+    if data.get('compact'):
+        aggregate = CompactAggregate.load(data)
+    elif data.get('capacity'):
+        aggregate = HeavyHittersAggregate.load(data)
+    else:
+        aggregate = LogAggregate.load(data)
+    aggregate.normalize = spec.normalizer
+    return aggregate
+
+
+def spec_key(spec):
+    """ Return JSON serializable key of AggregateSpec to check
+    that saved aggregate was built the same way """
+
+    normalizer = spec.normalizer
+    return [spec.exact, spec.top_urls,
+            normalizer and [normalizer.rules, normalizer.strip_query],
+            list(spec.dimensions)]
 
-def gen_parse_log(log_path):
-    """ Generator, Reading log and return data"""
 
-    if log_path.endswith(".gz"):
-        log = gzip.open(log_path, 'rb+')
+def check_error_rate(errors, lines, error_rate):
+    """ Raise ErrorRateExceeded if share of errors in lines is over error_rate """
+
+    if error_rate and lines and errors / lines > error_rate:
+        raise ErrorRateExceeded(
+            f'{errors} of {lines} lines don\'t match the log format')
+
+
+def aggregate_records(aggregate, records, error_rate=None):
+    """ Add records to aggregate and return it. The share of broken lines
+    is checked every ERROR_CHECK_LINES lines, so a log in unexpected
+    format is abandoned early """
+
+    errors = aggregate.errors_count
+    for lines, record in enumerate(records, 1):
+        aggregate.add(record)
+        if error_rate and not lines % ERROR_CHECK_LINES:
+            check_error_rate(aggregate.errors_count - errors, lines, error_rate)
+
+    return aggregate
+
+
+def sample_log(log_path, lines):
+    """ Return about lines raw lines from head, middle and tail of plain log,
+    compressed log can't be seeked, so only its head is sampled """
+
+    if is_compressed(log_path):
+        return list(islice(gen_log_lines(log_path), lines))
+
+    part = max(lines // 3, 1)
+    size = os.path.getsize(log_path)
+    with open(log_path, 'rb') as log:
+        sample = list(islice(log, part))
+        head_size = sum(map(len, sample))
+        for offset in (size // 2, max(size - head_size, 0)):
+            log.seek(offset)
+            if offset:
+                log.readline()
+            sample.extend(islice(log, part))
+
+    return sample
+
+
+def validate_log(log_path, lines, error_rate):
+    """ Parse sample of log before the full pass,
+    raise ErrorRateExceeded if too many lines are broken """
+
+    sample = sample_log(log_path, lines)
+    errors = sum(1 for line in sample if parse_line(line) is None)
+    logging.info(f'{errors} of {len(sample)} sample lines are broken')
+    check_error_rate(errors, len(sample), error_rate)
+
+
+def split_log(log_path, parts, start=0, end=None):
+    """ Return list of (start, end) byte ranges of plain log between
+    start and end, each range starts and ends on a line boundary """
+
+    if end is None:
+        end = os.path.getsize(log_path)
+    size = end - start
+    bounds = [start]
+
+    with open(log_path, 'rb') as log:
+        for part in range(1, parts):
+            log.seek(max(start + size * part // parts, bounds[-1]))
+            log.readline()
+            bounds.append(min(log.tell(), end))
+    bounds.append(end)
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def parse_log_range(log_path, start, end, spec=AggregateSpec()):
+    """ Worker, return LogAggregate of plain log lines in [start, end) """
+
+    if spec.dimensions:
+        records = map(parse_entry, gen_mapped_lines(log_path, start, end, spec.live))
     else:
-        log = open(log_path, 'rb+')
+        records = gen_parse_mapped(log_path, start, end, spec.live)
+    return aggregate_records(new_aggregate(spec), records, spec.error_rate)
+
+
+def parse_lines(lines, spec=AggregateSpec()):
+    """ Worker, return LogAggregate of raw log lines """
+
+    records = map(parse_entry if spec.dimensions else parse_line, lines)
+    return aggregate_records(new_aggregate(spec), records, spec.error_rate)
+
+
+def gen_log_batches(log_path, batch_size):
+    """ Generator, return decompressed log lines in batches """
+
+    batch = []
+    for line in gen_log_lines(log_path):
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 
-    for line in log:
-        line = line.decode('utf-8')
-        match = log_record_pattern.search(line)
-        if not match:
-            yield None
-            continue
+def imap_bounded(pool, func, tasks, limit):
+    """ Like Pool.starmap, but lazy: keeps at most limit tasks in flight
+    and yields results in tasks order """
 
-        yield LogRecord(match.group('url'), float(match.group('request_time')))
+    pending = deque()
+    for args in tasks:
+        pending.append(pool.apply_async(func, args))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
-    log.close()
+
+def parse_log_parallel(log_path, workers, spec=AggregateSpec(), start=0, end=None):
+    """ Parsing log in process pool and return merged LogAggregate,
+    start and end limit the byte range of plain log """
+
+    if is_compressed(log_path):
+        func = parse_lines
+        tasks = ((batch, spec)
+                 for batch in gen_log_batches(log_path, LOG_BATCH_LINES))
+    else:
+        func = parse_log_range
+        ranges = split_log(log_path, workers, start, end)
+        run_metrics.count('bytes_read', sum(end - start for start, end in ranges))
+        tasks = ((log_path, range_start, range_end, spec)
+                 for range_start, range_end in ranges)
+
+    aggregate = new_aggregate(spec)
+    with Pool(workers) as pool:
+        for partial in imap_bounded(pool, func, tasks, workers * 2):
+            aggregate.merge(partial)
+
+    return aggregate
 
 
 def calc_time(url, time, total_time, total_count):
@@ -111,27 +837,97 @@ def calc_time(url, time, total_time, total_count):
         "count_perc": count/total_count*100}
 
 
-def generate_report(log_path, parser, error_limit=None):
-    """ Parsing log file and return report data """
+def calc_times_numpy(aggregate, total_count, report_size=None):
+    """ Calculate times of every url of CompactAggregate at once with NumPy,
+    rows are the same calc_time returns. Request times are sorted by
+    (url, time) with lexsort and reduced per url with reduceat """
+
+    url_ids = numpy.frombuffer(aggregate.url_ids, dtype=numpy.uint32)
+    times = numpy.frombuffer(aggregate.times, dtype=numpy.float64)
+
+    order = numpy.lexsort((times, url_ids))
+    sorted_ids, sorted_times = url_ids[order], times[order]
+    starts = numpy.flatnonzero(numpy.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    counts = numpy.diff(numpy.r_[starts, len(sorted_times)])
+    sums = numpy.add.reduceat(sorted_times, starts)
+    maxes = numpy.maximum.reduceat(sorted_times, starts)
+    # calc_time takes the first request time of url with less than 3 requests
+    _, first = numpy.unique(url_ids, return_index=True)
+    medians = numpy.where(
+        counts > 2,
+        sorted_times[numpy.minimum(starts + (counts + 1) // 2, len(sorted_times) - 1)],
+        times[first])
+    total_time = float(sums.sum())
+
+    ids = sorted_ids[starts]
+    if report_size:
+        top = numpy.argsort(-sums, kind='stable')[:report_size]
+        ids, counts, sums, maxes, medians = \
+            ids[top], counts[top], sums[top], maxes[top], medians[top]
+
+    urls = list(aggregate.ids)
+    return [{
+        "url": urls[url_id],
+        "count": count,
+        "time_sum": time_sum,
+        "time_avg": time_sum/count,
+        "time_max": time_max,
+        "time_med": time_med,
+        "time_perc": time_sum/total_time*100,
+        "count_perc": count/total_count*100}
+        for url_id, count, time_sum, time_max, time_med in zip(
+            ids.tolist(), counts.tolist(), sums.tolist(), maxes.tolist(),
+            medians.tolist())]
+
 
-    logging.info(f'Parsing last log: {log_path}')
+def calc_stats(url, stats, total_time, total_count):
+    """ Calculate times from TimeSketch """
+    return {
+        "url": url,
+        "count": stats.count,
+        "time_sum": stats.sum,
+        "time_avg": stats.sum/stats.count,
+        "time_max": stats.max,
+        "time_med": stats.quantile(0.5),
+        "time_p90": stats.quantile(0.9),
+        "time_p99": stats.quantile(0.99),
+        "time_perc": stats.sum/total_time*100,
+        "count_perc": stats.count/total_count*100}
+
+
+class Report(list):
+    """ Report rows of urls, report of every dimension is in dimensions """
+
+    def __init__(self, rows=(), dimensions=None):
+        super(Report, self).__init__(rows)
+        self.dimensions = dimensions or {}
+
+
+def build_report(aggregate, error_limit=None, report_size=None, error_rate=None,
+                 use_numpy=False):
+    """ Return report data from LogAggregate,
+    with report_size only that many urls with the largest time_sum
+    are calculated, ordered by time_sum.
+    use_numpy calculates times of exact aggregate with calc_times_numpy.
+    Raise ErrorRateExceeded if share of broken lines is over error_rate """
+
+    compact = getattr(aggregate, 'aggregate', aggregate)
+    vectorized = use_numpy and numpy is not None and isinstance(compact, CompactAggregate)
+    if vectorized:
+        total_count = compact.total_count
+        unique_urls = len(compact.ids)
+    else:
+        urls = aggregate.urls
+        total_count = sum(stats.count for stats in urls.values()) + \
+            aggregate.evicted_count
+        unique_urls = len(urls)
 
-    urls = {}
-    report = []
-    errors_count = 0
-    total_count = 0
-    total_time = 0
+    run_metrics.count('lines', total_count + aggregate.errors_count)
+    run_metrics.count('parse_errors', aggregate.errors_count)
+    run_metrics.count('unique_urls', unique_urls)
 
-    for record in parser(log_path):
-        if not record:
-            errors_count += 1
-            continue
-        if record.url not in urls:
-            urls.update({record.url: [record.time, ]})
-        else:
-            urls[record.url].append(record.time)
-        total_time += record.time
-        total_count += 1
+    check_error_rate(aggregate.errors_count, total_count + aggregate.errors_count,
+                     error_rate)
 
     if not total_count:
         logging.info('Log is empty')
@@ -139,35 +935,312 @@ def generate_report(log_path, parser, error_limit=None):
 
     logging.info('Calculating time')
 
-    for url, time in urls.items():
-        report.append(calc_time(url, time, total_time, total_count))
-
-    if error_limit and errors_count > error_limit:
+    if vectorized:
+        with run_metrics.stage('calc_time'):
+            report = Report(calc_times_numpy(compact, total_count, report_size))
+    else:
+        total_time = sum(stats.sum for stats in urls.values()) + aggregate.evicted_time
+        calc = calc_time if aggregate.exact else calc_stats
+        items = urls.items()
+        if report_size:
+            sums = {url: stats.sum for url, stats in items}
+            items = heapq.nlargest(report_size, items, key=lambda item: sums[item[0]])
+        with run_metrics.stage('calc_time'):
+            report = Report(calc(url, stats, total_time, total_count)
+                            for url, stats in items)
+        if isinstance(compact, HeavyHittersAggregate):
+            # time_sum of tracked url is a lower bound, true one is up to error more
+            for row in report:
+                row['time_sum_error'] = compact.errors.get(row['url'], 0)
+    for name, dimension in getattr(aggregate, 'dimensions', {}).items():
+        report.dimensions[name] = dimension.report()
+
+    if error_limit and aggregate.errors_count > error_limit:
         logging.warning("Exceeded errors limit!")
 
     return report
 
 
-def write_report(cfg, report, report_file):
-    """ Write report to file """
+def generate_report(log_path, parser, spec=AggregateSpec(), error_limit=None,
+                    workers=1, report_size=None, use_numpy=False):
+    """ Parsing log file and return report data of aggregate built by spec,
+    parsing stops with ErrorRateExceeded once share of broken lines
+    is over spec.error_rate, use_numpy calculates exact report with NumPy """
+
+    logging.info(f'Parsing last log: {log_path}')
+
+    with run_metrics.stage('gen_parse_log'):
+        if workers > 1:
+            logging.info(f'Using {workers} worker processes')
+            aggregate = parse_log_parallel(log_path, workers, spec)
+        else:
+            records = parser(log_path, bool(spec.dimensions), spec.live)
+            aggregate = aggregate_records(new_aggregate(spec), records, spec.error_rate)
+
+    return build_report(aggregate, error_limit, report_size, spec.error_rate, use_numpy)
+
+
+def aggregate_log(log_path, cache_file, spec=AggregateSpec()):
+    """ Worker, return LogAggregate of the whole log.
+    It's cached in gzipped cache_file and is parsed again only if
+    the log has changed since """
 
-    with open(cfg['REPORT_DIR']+'/report.html') as file:
+    stat = os.stat(log_path)
+    identity = [stat.st_size, stat.st_mtime_ns]
+
+    try:
+        with gzip.open(cache_file, 'rt') as file:
+            cache = json.load(file)
+        if cache['log'] == identity and cache['spec'] == spec_key(spec):
+            return load_aggregate(cache['aggregate'], spec)
+    except FileNotFoundError:
+        pass
+
+    logging.info(f'Parsing log: {log_path}')
+    records = gen_parse_log(log_path, entries=bool(spec.dimensions))
+    aggregate = aggregate_records(new_aggregate(spec), records, spec.error_rate)
+    check_error_rate(aggregate.errors_count,
+                     aggregate.total_count + aggregate.errors_count, spec.error_rate)
+
+    with gzip.open(cache_file + '.tmp', 'wt') as file:
+        json.dump({"log": identity, "spec": spec_key(spec),
+                   "aggregate": aggregate.dump()}, file)
+    os.replace(cache_file + '.tmp', cache_file)
+
+    return aggregate
+
+
+def generate_range_report(logs, cache_dir, spec=AggregateSpec(), error_limit=None,
+                          workers=1, report_size=None, use_numpy=False):
+    """ Return report data of several logs merging their
+    per-day aggregates, which are parsed in parallel and cached in cache_dir """
+
+    tasks = [(log.path, cache_dir + '/aggregate-{}.json.gz'.format(
+        log.date.strftime('%Y.%m.%d')), spec) for log in logs]
+
+    aggregate = new_aggregate(spec)
+    with run_metrics.stage('gen_parse_log'):
+        if workers > 1:
+            with Pool(workers) as pool:
+                for partial in imap_bounded(pool, aggregate_log, tasks, workers):
+                    aggregate.merge(partial)
+        else:
+            for task in tasks:
+                aggregate.merge(aggregate_log(*task))
+
+    return build_report(aggregate, error_limit, report_size, spec.error_rate, use_numpy)
+
+
+def last_line_end(log_path, block_size=65536):
+    """ Return offset right after the last complete line of plain log """
+
+    with open(log_path, 'rb') as log:
+        position = log.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(position - block_size, 0)
+            log.seek(start)
+            newline = log.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+
+    return 0
+
+
+def load_state(state_file, log_path, spec=AggregateSpec()):
+    """ Return (offset, LogAggregate) saved by the previous run
+    or (0, empty LogAggregate) if the log was replaced or truncated since """
+
+    try:
+        with open(state_file) as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return 0, new_aggregate(spec)
+
+    stat = os.stat(log_path)
+    if (state['inode'], state['device']) != (stat.st_ino, stat.st_dev) or \
+            state['size'] > stat.st_size or state['spec'] != spec_key(spec):
+        logging.info('Log has changed since the last run, starting over')
+        return 0, new_aggregate(spec)
+
+    return state['offset'], load_aggregate(state['aggregate'], spec)
+
+
+def save_state(state_file, log_path, offset, aggregate, spec=AggregateSpec()):
+    """ Save parsed offset and LogAggregate of the log """
+
+    stat = os.stat(log_path)
+    state = {
+        "path": log_path,
+        "inode": stat.st_ino,
+        "device": stat.st_dev,
+        "size": stat.st_size,
+        "offset": offset,
+        "spec": spec_key(spec),
+        "aggregate": aggregate.dump()}
+
+    with open(state_file + '.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def generate_report_incremental(log_path, state_file, spec=AggregateSpec(),
+                                error_limit=None, workers=1, report_size=None,
+                                use_numpy=False):
+    """ Parsing only lines appended to plain log since the previous run
+    and return report data of the whole log """
+
+    offset, aggregate = load_state(state_file, log_path, spec)
+    end = last_line_end(log_path)
+
+    logging.info(f'Parsing {log_path} from {offset} to {end} byte')
+
+    if end > offset:
+        with run_metrics.stage('gen_parse_log'):
+            if workers > 1:
+                logging.info(f'Using {workers} worker processes')
+                tail = parse_log_parallel(log_path, workers, spec, offset, end)
+            else:
+                tail = parse_log_range(log_path, offset, end, spec)
+                run_metrics.count('bytes_read', end - offset)
+            check_error_rate(tail.errors_count, tail.total_count + tail.errors_count,
+                             spec.error_rate)
+            aggregate.merge(tail)
+        save_state(state_file, log_path, end, aggregate, spec)
+    else:
+        logging.info('No new lines in log')
+
+    return build_report(aggregate, error_limit, report_size, spec.error_rate, use_numpy)
+
+
+def write_table(file, table):
+    """ Write table to file row by row, same as str(table) """
+
+    file.write('[')
+    for number, row in enumerate(table):
+        if number:
+            file.write(', ')
+        file.write(repr(row))
+    file.write(']')
+
+
+def write_template(file, template, name, write_value):
+    """ Write template to file like Template.safe_substitute does,
+    but $name placeholder is written by write_value(file) """
+
+    position = 0
+    for match in Template.pattern.finditer(template):
+        file.write(template[position:match.start()])
+        position = match.end()
+        if name in (match.group('named'), match.group('braced')):
+            write_value(file)
+        elif match.group('escaped') is not None:
+            file.write(Template.delimiter)
+        else:
+            file.write(match.group())
+    file.write(template[position:])
+
+
+templates = {}
+
+
+def read_template(template_file):
+    """ Return report template, it's read again only if the file has changed """
+
+    mtime = os.stat(template_file).st_mtime_ns
+    cached = templates.get(template_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(template_file) as file:
         report_template = file.read()
+    templates[template_file] = (mtime, report_template)
+    return report_template
 
-    table_json = {'table_json': sorted(
-        report, key=lambda i: i['time_sum'], reverse=True)[:cfg['REPORT_SIZE']]}
 
-    html_report = Template(report_template).safe_substitute(table_json)
+def write_report(cfg, report, report_file):
+    """ Write report to file """
+
+    report_template = read_template(cfg['REPORT_DIR']+'/report.html')
+
+    table = heapq.nlargest(cfg['REPORT_SIZE'], report, key=lambda i: i['time_sum'])
 
     with open(report_file, 'w+') as file:
-        file.write(html_report)
+        write_template(file, report_template, 'table_json',
+                       lambda file: write_table(file, table))
+
+
+def write_dimensions(report_file, dimensions):
+    """ Write report of every dimension next to report """
+
+    dimensions_file = report_file[:-len('.html')] + '.dimensions.json'
+    logging.info(f'Writing dimensions to {dimensions_file}')
+    with open(dimensions_file, 'w') as file:
+        json.dump(dimensions, file, indent=4)
+
+
+def write_metrics(report_file):
+    """ Write run metrics next to report """
+
+    metrics_file = report_file[:-len('.html')] + '.metrics.json'
+    logging.info(f'Writing metrics to {metrics_file}')
+    run_metrics.write(metrics_file)
+
+
+def get_normalizer(cfg):
+    """ Return UrlNormalizer from config or None if urls are kept as is """
+
+    if not (cfg['URL_RULES'] or cfg['STRIP_QUERY']):
+        return None
+    return UrlNormalizer(cfg['URL_RULES'], cfg['STRIP_QUERY'])
+
+
+def get_spec(cfg, live=False):
+    """ Return AggregateSpec of reports configured by cfg """
 
+    return AggregateSpec(cfg['EXACT'], get_normalizer(cfg), cfg['TOP_URLS'],
+                         cfg['ERROR_RATE'], tuple(cfg['DIMENSIONS']), live)
 
-def create_report(cfg):
-    """ Creating report """
 
-    logging.info('Getting last log')
-    last_log = get_last_log(cfg['LOG_DIR'])
+def make_report(cfg, logs, report_file, generate, live=False):
+    """ Check sample of every log, generate report with
+    generate(spec, error_limit, workers, report_size, use_numpy)
+    and write it to report_file along with its dimensions and metrics """
+
+    try:
+        if cfg['ERROR_RATE'] and cfg['SAMPLE_LINES']:
+            with run_metrics.stage('validate_log'):
+                for log in logs:
+                    validate_log(log.path, cfg['SAMPLE_LINES'], cfg['ERROR_RATE'])
+
+        with run_metrics.stage('generate_report'):
+            report = generate(get_spec(cfg, live), cfg['ERROR_LIMIT'], cfg['WORKERS'],
+                              cfg['REPORT_SIZE'], cfg['NUMPY'])
+    except ErrorRateExceeded as exc:
+        paths = ', '.join(log.path for log in logs)
+        logging.error(f'Log {paths} looks broken, report isn\'t created: {exc}')
+        return
+    if not report:
+        return
+
+    logging.info(f'Writing report to {report_file}')
+    with run_metrics.stage('write_report'):
+        write_report(cfg, report, report_file)
+        if report.dimensions:
+            write_dimensions(report_file, report.dimensions)
+    write_metrics(report_file)
+
+    logging.info('Done')
+
+
+def create_report(cfg, last_log=None, live=False):
+    """ Creating report of last_log, the last log in LOG_DIR by default,
+    live log may still be written or truncated, incremental one always is """
+
+    if not last_log:
+        logging.info('Getting last log')
+        with run_metrics.stage('get_last_log'):
+            last_log = get_last_log(cfg['LOG_DIR'])
     if not last_log.path:
         logging.error('Logs not found')
         return
@@ -175,17 +1248,84 @@ def create_report(cfg):
     logging.info('Check existing report')
     report_file = cfg['REPORT_DIR'] + \
         '/report-{}.html'.format(last_log.date.strftime('%Y.%m.%d'))
-    if os.path.exists(report_file):
+    incremental = cfg['INCREMENTAL'] and not is_compressed(last_log.path)
+    if os.path.exists(report_file) and not incremental:
         logging.info(f'Report already have being done {report_file}')
         return
 
     logging.info("Generate report")
-    report = generate_report(last_log.path, cfg['ERROR_LIMIT'])
+    if incremental:
+        state_file = report_file[:-len('.html')] + '.state.json'
+        generate = partial(generate_report_incremental, last_log.path, state_file)
+    else:
+        generate = partial(generate_report, last_log.path, gen_parse_log)
+    make_report(cfg, [last_log], report_file, generate, live or incremental)
 
-    logging.info(f'Writing report to {report_file}')
-    write_report(cfg, report, report_file)
 
-    logging.info('Done')
+def create_range_report(cfg, date_from=None, date_to=None):
+    """ Creating report over logs from date_from to date_to """
+
+    logging.info('Getting logs')
+    with run_metrics.stage('get_logs'):
+        logs = get_logs(cfg['LOG_DIR'], date_from, date_to)
+    if not logs:
+        logging.error('Logs not found')
+        return
+
+    logging.info('Check existing report')
+    report_file = cfg['REPORT_DIR'] + '/report-{}-{}.html'.format(
+        logs[0].date.strftime('%Y.%m.%d'), logs[-1].date.strftime('%Y.%m.%d'))
+    if os.path.exists(report_file):
+        logging.info(f'Report already have being done {report_file}')
+        return
+
+    logging.info(f'Generate report over {len(logs)} logs')
+    make_report(cfg, logs, report_file,
+                partial(generate_range_report, logs, cfg['REPORT_DIR']))
+
+
+def watch(cfg, stop=None):
+    """ Create report when a new log appears in LOG_DIR, checking it
+    every WATCH_INTERVAL seconds until stop is set. A log is reported once
+    its size and mtime are the same as at the previous check, so a log still
+    being written or compressed by logrotate isn't reported half-done.
+    In incremental mode the report is also updated when the last plain log
+    grows, complete lines are parsed as soon as they appear """
+
+    stop = stop or threading.Event()
+    index = LogIndex(cfg['LOG_DIR'])
+    reported = None
+    # (path, size, mtime) of the last log at the previous check
+    seen = None
+
+    logging.info(f'Watching {cfg["LOG_DIR"]} every {cfg["WATCH_INTERVAL"]} seconds')
+    while not stop.is_set():
+        try:
+            index.scan()
+            last_log = index.get_last_log()
+            current, settled = None, True
+            if last_log.path:
+                stat = os.stat(last_log.path)
+                state = (last_log.path, stat.st_size, stat.st_mtime_ns)
+                incremental = cfg['INCREMENTAL'] and not is_compressed(last_log.path)
+                current = state if incremental else last_log.path
+                settled = incremental or state == seen
+                seen = state
+            if current != reported and settled:
+                run_metrics.reset()
+                create_report(cfg, last_log, live=True)
+                reported = current
+        except Exception as exc:
+            logging.exception(f'Can\'t create report {exc}')
+        stop.wait(cfg['WATCH_INTERVAL'])
+
+
+def parse_date(value):
+    """ Return date from YYYY-MM-DD command line argument """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid date: {value}')
 
 
 def get_args_from_cli():
@@ -195,6 +1335,36 @@ def get_args_from_cli():
     cfg_parser.add_argument('--config',
                             help='Path to config file',
                             default=DEFAULT_CONFIG)
+    cfg_parser.add_argument('--workers',
+                            help='Number of processes parsing the log',
+                            type=int)
+    cfg_parser.add_argument('--exact',
+                            help='Keep every request time for exact median',
+                            action='store_true')
+    cfg_parser.add_argument('--incremental',
+                            help='Parse only lines appended since the previous run',
+                            action='store_true')
+    cfg_parser.add_argument('--top-urls',
+                            help='Track at most this many heaviest urls',
+                            type=int)
+    cfg_parser.add_argument('--from',
+                            help='Report over logs since this date, YYYY-MM-DD',
+                            dest='date_from', type=parse_date)
+    cfg_parser.add_argument('--to',
+                            help='Report over logs until this date, YYYY-MM-DD',
+                            dest='date_to', type=parse_date)
+    cfg_parser.add_argument('--numpy',
+                            help='Calculate exact report with NumPy',
+                            action='store_true')
+    cfg_parser.add_argument('--dimensions',
+                            help='Report these dimensions along with urls',
+                            nargs='+', choices=sorted(DIMENSIONS))
+    cfg_parser.add_argument('--watch',
+                            help='Keep running and report on every new log',
+                            action='store_true')
+    cfg_parser.add_argument('--profile',
+                            help='Dump cProfile stats of the run to file',
+                            nargs='?', const='log_analyzer.prof')
     return cfg_parser.parse_args()
 
 
@@ -230,6 +1400,49 @@ def check_config(config):
         logging.error('Wrong error limit value!')
         raise ValueError
 
+    if config['WORKERS'] < 1:
+        logging.error('Wrong workers count!')
+        raise ValueError
+
+    if not 0 <= config['ERROR_RATE'] <= 1:
+        logging.error('Wrong error rate value!')
+        raise ValueError
+
+    if config['SAMPLE_LINES'] < 0:
+        logging.error('Wrong sample lines count!')
+        raise ValueError
+
+    if config['WATCH_INTERVAL'] <= 0:
+        logging.error('Wrong watch interval!')
+        raise ValueError
+
+    if config['TOP_URLS'] < 0:
+        logging.error('Wrong top urls count!')
+        raise ValueError
+
+    if 0 < config['TOP_URLS'] < config['REPORT_SIZE']:
+        logging.warning('TOP_URLS is less than REPORT_SIZE, report will be short')
+
+    if config['NUMPY'] and numpy is None:
+        logging.warning('NumPy isn\'t installed, report is calculated without it')
+        config['NUMPY'] = False
+
+    if config['NUMPY'] and not config['EXACT']:
+        logging.warning('NUMPY is used only for EXACT report')
+
+    for name in config['DIMENSIONS']:
+        if name not in DIMENSIONS:
+            logging.error(f'Unknown dimension {name}!')
+            raise ValueError
+
+    for rule in config['URL_RULES']:
+        try:
+            pattern, _ = rule
+            re.compile(pattern)
+        except (ValueError, re.error):
+            logging.error(f'Wrong url rule {rule}!')
+            raise ValueError
+
 
 def main():
 
@@ -237,9 +1450,42 @@ def main():
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
 
     try:
-        cfg = setup_config(get_args_from_cli().config)
+        args = get_args_from_cli()
+        cfg = setup_config(args.config)
+        if args.workers is not None:
+            cfg['WORKERS'] = args.workers
+        if args.exact:
+            cfg['EXACT'] = True
+        if args.incremental:
+            cfg['INCREMENTAL'] = True
+        if args.top_urls is not None:
+            cfg['TOP_URLS'] = args.top_urls
+        if args.dimensions:
+            cfg['DIMENSIONS'] = args.dimensions
+        if args.numpy:
+            cfg['NUMPY'] = True
         check_config(cfg)
-        create_report(cfg)
+
+        profile = cProfile.Profile() if args.profile else None
+        if profile:
+            profile.enable()
+        try:
+            if args.watch:
+                stop = threading.Event()
+                signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+                try:
+                    watch(cfg, stop)
+                except KeyboardInterrupt:
+                    logging.info('Stopped')
+            elif args.date_from or args.date_to:
+                create_range_report(cfg, args.date_from, args.date_to)
+            else:
+                create_report(cfg)
+        finally:
+            if profile:
+                profile.disable()
+                logging.info(f'Writing profile to {args.profile}')
+                profile.dump_stats(args.profile)
     except Exception as exc:
         logging.exception(f'Can\'t create report {exc}')
 
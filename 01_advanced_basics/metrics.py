@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+""" Run metrics: per-stage timers and counters """
+
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+
+class RunMetrics(object):
+    """ Wall/CPU time of named stages and counters of a run,
+    stages may nest and repeat, their times add up """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.stages = {}
+        self.counters = {}
+
+    def add_time(self, name, wall, cpu=0.0):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['calls'] += 1
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name):
+        """ Context manager timing the stage, CPU time is of the whole process """
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started,
+                          time.process_time() - cpu_started)
+
+    def dump(self):
+        """ Return JSON serializable metrics of the run so far """
+        # Linux reports ru_maxrss in kilobytes
+        return {
+            "wall": time.perf_counter() - self.started,
+            "cpu": time.process_time() - self.cpu_started,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "workers_peak_rss_mb":
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            "stages": self.stages,
+            "counters": self.counters}
+
+    def write(self, metrics_file):
+        with open(metrics_file, 'w') as file:
+            json.dump(self.dump(), file, indent=4)
+
+
+run_metrics = RunMetrics()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+""" Log readers, compressed logs are decompressed in a background thread """
+
+import io
+import os
+import bz2
+import mmap
+import lzma
+import zlib
+import time
+import queue
+import threading
+
+from metrics import run_metrics
+
+
+# compressed bytes read from file at once
+CHUNK_SIZE = 1024 * 1024
+# decompressed batches waiting for the consumer
+QUEUE_SIZE = 8
+# bytes of mapped plain log scanned at once
+WINDOW_SIZE = 16 * 1024 * 1024
+
+DECOMPRESSORS = {
+    '.gz': lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+    '.bz2': bz2.BZ2Decompressor,
+    '.xz': lzma.LZMADecompressor,
+}
+
+
+def get_decompressor(log_path):
+    """ Return decompressor factory for log or None for plain log """
+    for extension, decompressor in DECOMPRESSORS.items():
+        if log_path.endswith(extension):
+            return decompressor
+    return None
+
+
+def is_compressed(log_path):
+    return get_decompressor(log_path) is not None
+
+
+def gen_decompress(log_path, chunk_size):
+    """ Generator, return decompressed chunks of log,
+    concatenated streams (multi-member gzip etc.) are supported.
+    Raise EOFError if the log is truncated, data after the end of a stream
+    is decompressed as the next stream, so trailing garbage is an error too """
+
+    new_decompressor = get_decompressor(log_path)
+    decompressor = new_decompressor()
+    # the current stream has started but not reached its end
+    pending = False
+
+    with open(log_path, 'rb') as log:
+        for data in iter(lambda: log.read(chunk_size), b''):
+            run_metrics.count('bytes_read', len(data))
+            while data:
+                started = time.perf_counter()
+                chunk = decompressor.decompress(data)
+                run_metrics.add_time('decompress', time.perf_counter() - started)
+                yield chunk
+                data = b''
+                pending = not decompressor.eof
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = new_decompressor()
+
+    if pending:
+        raise EOFError(f'Compressed log {log_path} ended before the end of stream')
+
+
+def gen_decompressed_lines(log_path):
+    """ Generator, return lists of complete lines of compressed log """
+
+    tail = b''
+    for chunk in gen_decompress(log_path, CHUNK_SIZE):
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        if lines:
+            yield [line + b'\n' for line in lines]
+    if tail:
+        yield [tail]
+
+
+def _decompress_worker(log_path, batches, stop):
+    """ Thread, put line batches of log to queue, then None.
+    Exception is put to queue to be raised by the consumer """
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for batch in gen_decompressed_lines(log_path):
+            if not put(batch):
+                return
+    except Exception as exc:
+        put(exc)
+        return
+    put(None)
+
+
+def gen_pipelined_batches(log_path):
+    """ Generator, return line batches of compressed log decompressed
+    in a background thread, so decompression overlaps parsing """
+
+    batches = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    worker = threading.Thread(target=_decompress_worker,
+                              args=(log_path, batches, stop), daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        worker.join()
+
+
+def gen_log_lines(log_path):
+    """ Generator, return raw lines of plain or compressed log """
+
+    if not is_compressed(log_path):
+        with open(log_path, 'rb') as log:
+            yield from log
+            run_metrics.count('bytes_read', log.tell())
+        return
+
+    for batch in gen_pipelined_batches(log_path):
+        yield from batch
+
+
+def gen_mmap_windows(log_path, start=0, end=None):
+    """ Generator, return (buffer, start, end) windows of plain log
+    mapped read-only, each window but the last ends right after a line break.
+    The buffer is valid only until the next window is requested """
+
+    with open(log_path, 'rb') as log:
+        size = os.fstat(log.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+
+        with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            while start < end:
+                window_end = buffer.find(b'\n', min(start + WINDOW_SIZE, end) - 1, end)
+                window_end = end if window_end < 0 else window_end + 1
+                yield buffer, start, window_end
+                start = window_end
+
+
+def gen_read_windows(log_path, start=0, end=None):
+    """ Generator, return the same windows as gen_mmap_windows, but read
+    into memory. A log still being written may be truncated meanwhile:
+    reading its mapping then kills the process with SIGBUS, while here
+    the read just comes up short and EOFError is raised """
+
+    with open(log_path, 'rb') as log:
+        size = os.fstat(log.fileno()).st_size
+        end = size if end is None else min(end, size)
+        log.seek(start)
+
+        window = b''
+        while start < end:
+            chunk = log.read(min(WINDOW_SIZE, end - start))
+            if not chunk:
+                raise EOFError(f'Log {log_path} was truncated while being read')
+            start += len(chunk)
+            window += chunk
+            window_end = len(window) if start >= end else window.rfind(b'\n') + 1
+            if window_end:
+                yield window, 0, window_end
+                window = window[window_end:]
+
+
+def gen_windows(log_path, start=0, end=None, live=False):
+    """ Generator, return windows of plain log, mapped unless it's live,
+    that is may still be written or truncated """
+
+    if live:
+        return gen_read_windows(log_path, start, end)
+    return gen_mmap_windows(log_path, start, end)
+
+
+def gen_mapped_lines(log_path, start=0, end=None, live=False):
+    """ Generator, return raw lines of plain log in [start, end) """
+
+    for buffer, start, end in gen_windows(log_path, start, end, live):
+        yield from io.BytesIO(buffer[start:end])
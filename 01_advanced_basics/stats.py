@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+""" Per-url request time statistics """
+
+import math
+from array import array
+
+
+# quantiles returned by TimeSketch are within this relative error
+RELATIVE_ACCURACY = 0.01
+# $request_time has millisecond resolution, anything below is zero
+MIN_TIME = 0.0005
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+
+def quantile_rank(q, count):
+    """ Return index of q-quantile in sorted list of count items.
+    For q=0.5 it's the element calc_time reports as median, except that
+    with up to 2 items it's the smallest one, not the first one logged """
+
+    if q == 0.5 and count <= 2:
+        return 0
+    return min(int(q * (count + 1)), count - 1)
+
+
+class TimeList(list):
+    """ All request times of url, exact but memory grows with requests """
+
+    add = list.append
+    merge = list.extend
+
+    @property
+    def count(self):
+        return len(self)
+
+    @property
+    def sum(self):
+        return sum(self)
+
+    @property
+    def max(self):
+        return max(self)
+
+    def quantile(self, q):
+        return sorted(self)[quantile_rank(q, len(self))]
+
+    def dump(self):
+        return list(self)
+
+    @classmethod
+    def load(cls, data):
+        return cls(data)
+
+
+class TimeArray(array):
+    """ All request times of url unboxed in array of doubles """
+
+    def __new__(cls, data=()):
+        return super(TimeArray, cls).__new__(cls, 'd', data)
+
+    add = array.append
+    merge = array.extend
+    count = TimeList.count
+    sum = TimeList.sum
+    max = TimeList.max
+    quantile = TimeList.quantile
+    dump = TimeList.dump
+    load = TimeList.load
+
+
+class TimeSketch(object):
+    """ Request times of url in fixed memory: count, sum and max are exact,
+    quantiles come from a log-scale histogram with RELATIVE_ACCURACY error """
+
+    __slots__ = ('count', 'sum', 'max', 'zeros', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self.zeros = 0
+        self.buckets = {}
+
+    def add(self, time):
+        self.count += 1
+        self.sum += time
+        if time > self.max:
+            self.max = time
+
+        if time < MIN_TIME:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(time) / LOG_GAMMA)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q):
+        rank = quantile_rank(q, self.count)
+        if rank < self.zeros:
+            return 0.0
+
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return min(2 * GAMMA ** key / (GAMMA + 1), self.max)
+
+        return self.max
+
+    def dump(self):
+        """ Return JSON serializable representation """
+        return [self.count, self.sum, self.max, self.zeros,
+                sorted(self.buckets.items())]
+
+    @classmethod
+    def load(cls, data):
+        sketch = cls()
+        sketch.count, sketch.sum, sketch.max, sketch.zeros, buckets = data
+        sketch.buckets = {key: count for key, count in buckets}
+        return sketch
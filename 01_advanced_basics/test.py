@@ -1,9 +1,30 @@
 import unittest
 import pytest
 import os
+import gzip
+import bz2
+import lzma
+import ast
+import json
+import random
+import threading
 from time import sleep
 from datetime import date, datetime
-from log_analyzer import get_last_log, gen_parse_log, calc_time, Log, LogRecord
+from string import Template
+import log_analyzer
+from log_analyzer import get_last_log, gen_parse_log, calc_time, Log, LogRecord, \
+    generate_report, split_log, parse_line, parse_line_fast, parse_line_regex, \
+    generate_report_incremental, generate_range_report, get_logs, aggregate_log, \
+    LogAggregate, CompactAggregate, build_report, load_aggregate, write_report, \
+    AggregateSpec, UrlNormalizer, HeavyHittersAggregate, create_report, \
+    validate_log, sample_log, ErrorRateExceeded, gen_parse_mapped, LogIndex, watch, \
+    LogEntry, parse_entry, parse_entry_fast, parse_entry_regex
+from stats import TimeList, TimeSketch, RELATIVE_ACCURACY
+import readers
+from readers import gen_log_lines
+import bench
+from metrics import run_metrics
+from dimensions import DIMENSIONS
 
 
 def test_get_last_log(tmpdir):
@@ -15,8 +36,8 @@ def test_get_last_log(tmpdir):
     assert last_log.path == None
     assert last_log.date == None
 
-    # add .bz2 archive
-    open('nginx-access-ui.log-20040101.bz2', 'a').close()
+    # add .zip archive
+    open('nginx-access-ui.log-20040101.zip', 'a').close()
 
     # check plain files
     test_file_plain = 'nginx-access-ui.log-20010101'
@@ -36,6 +57,14 @@ def test_get_last_log(tmpdir):
     assert assertion_date == last_log.date
     assert assertion_path == last_log.path
 
+    # check bz2 and xz files
+    for test_file, assertion_date in (('nginx-access-ui.log-20030101.bz2', date(2003, 1, 1)),
+                                      ('nginx-access-ui.log-20050101.xz', date(2005, 1, 1))):
+        open(test_file, 'a').close()
+        last_log = get_last_log(str(tmpdir))
+        assert assertion_date == last_log.date
+        assert '{}/{}'.format(tmpdir, test_file) == last_log.path
+
 
 def test_calc_time():
     data = {'count': 10,
@@ -82,3 +111,785 @@ def test_gen_parse_log(tmpdir):
 
     assert log_record == assert_record
     
+
+
+def make_log_line(url, request_time):
+    return ('1.2.3.4 abc - [01/Jan/1970:11:11:11 +0300] "GET {} HTTP/1.1" '
+            '200 660 "-" "-" "-" "11-22" "-" {}\n').format(url, request_time)
+
+
+def write_test_log(path, count=1000):
+    lines = [make_log_line('/test/{}'.format(i % 7), (i % 13) / 1000)
+             for i in range(count)]
+    lines.insert(count // 2, 'broken line\n')
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wt') as file:
+            file.writelines(lines)
+    else:
+        with open(path, 'w') as file:
+            file.writelines(lines)
+
+
+def test_split_log(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+
+    ranges = split_log(log_path, 4)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == os.path.getsize(log_path)
+    with open(log_path, 'rb') as file:
+        data = file.read()
+    for start, end in ranges:
+        assert data[end - 1:end] == b'\n'
+
+
+@pytest.mark.parametrize('log_name', ['nginx-access-ui.log-20010101',
+                                      'nginx-access-ui.log-20010101.gz'])
+def test_generate_report_parallel(tmpdir, monkeypatch, log_name):
+    log_path = str(tmpdir.join(log_name))
+    write_test_log(log_path)
+    monkeypatch.setattr(log_analyzer, 'LOG_BATCH_LINES', 100)
+
+    serial = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True))
+    parallel = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True), workers=3)
+
+    assert parallel == serial
+
+
+def test_time_sketch():
+    random.seed(1)
+    times = [round(random.expovariate(10), 3) for _ in range(10000)]
+    sketch = TimeSketch()
+    for time in times[:5000]:
+        sketch.add(time)
+    other = TimeSketch()
+    for time in times[5000:]:
+        other.add(time)
+    sketch.merge(other)
+
+    exact = TimeList(times)
+    assert sketch.count == exact.count
+    assert sketch.sum == pytest.approx(exact.sum)
+    assert sketch.max == exact.max
+    for q in (0.5, 0.9, 0.99):
+        assert sketch.quantile(q) == pytest.approx(
+            exact.quantile(q), rel=RELATIVE_ACCURACY)
+
+
+@pytest.mark.parametrize('stats_class', [TimeList, TimeSketch])
+def test_quantile_few_times(stats_class):
+    stats = stats_class()
+    stats.add(5.0)
+    stats.add(0.1)
+
+    assert stats.quantile(0.5) == pytest.approx(0.1, rel=RELATIVE_ACCURACY)
+    assert stats.quantile(0.9) == stats.quantile(0.99) == stats.max == 5.0
+
+def test_generate_report_streaming(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+
+    exact = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True))
+    streaming = generate_report(log_path, gen_parse_log)
+
+    assert len(streaming) == len(exact)
+    for approx_row, exact_row in zip(streaming, exact):
+        assert approx_row['url'] == exact_row['url']
+        assert approx_row['count'] == exact_row['count']
+        for key in ('time_sum', 'time_max', 'time_perc', 'count_perc'):
+            assert approx_row[key] == pytest.approx(exact_row[key])
+        assert approx_row['time_med'] == pytest.approx(
+            exact_row['time_med'], rel=RELATIVE_ACCURACY)
+
+
+UI_SHORT_LINE = ('1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] '
+                 '"GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" '
+                 '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+                 '"1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n')
+
+PARITY_LINES = [
+    make_log_line('/api/v2/banner/25019354', 0.390),
+    make_log_line('/api/1/photogenic_banners/list/?server_name=WIN7RB4', 0.133),
+    make_log_line('/export/appinstall_raw/2017-06-29/', 0),
+    make_log_line('/test', '1.'),
+    make_log_line('/test', '1.2.3'),
+    make_log_line('/test', '-1'),
+    make_log_line('/test', 'inf'),
+    make_log_line('/тест', 0.1),
+    make_log_line('/test', 0.1).rstrip('\n'),
+    make_log_line('/test', 0.1).replace('\n', '\r\n'),
+    make_log_line('/test', 0.1).replace('1.2.3.4', 'host'),
+    make_log_line('/test', 0.1).replace(' HTTP/1.1', ''),
+    make_log_line('/test', 0.1).replace('"GET ', '"'),
+    '1.2.3.4 - - [29/Jun/2017:03:50:22 +0300] "0" 400 166 "-" "-" "-" "-" "-" 0.000\n',
+    '1.2.3.4 - - [29/Jun/2017:03:50:22 +0300] "-" 400 0 "-" "-" "-" "-" "-" 0.000\n',
+    'broken line\n',
+    '\n',
+    make_log_line('/test', 0.1).replace('abc', 'a]b'),
+    '1 [x] "GET /a HTTP/1.1" 5\n',
+    make_log_line('/test', 0.1).replace(' 200 660', ''),
+    make_log_line('/test', 0.1).replace(' "-" "-"', ''),
+    make_log_line('/test', 0.1).replace('1.2.3.4', '1.2.3.4.5'),
+    make_log_line('/test', 0.1).replace(' 200 ', ' 2000 '),
+    make_log_line('/test', 0.1).replace('/test', '/te\u00a0st'),
+    make_log_line('/test', 0.1).replace('/test', '/test\u00a0'),
+    UI_SHORT_LINE,
+]
+
+
+@pytest.mark.parametrize('line', PARITY_LINES)
+def test_parse_line_parity(line):
+    line = line.encode('utf-8')
+
+    assert parse_line(line) == parse_line_regex(line)
+    if parse_line_fast(line):
+        assert parse_line_fast(line) == parse_line_regex(line)
+
+
+@pytest.mark.parametrize('line', PARITY_LINES)
+def test_parse_entry_parity(line):
+    line = line.encode('utf-8')
+
+    assert parse_entry(line) == parse_entry_regex(line)
+    if parse_entry_fast(line):
+        assert parse_entry_fast(line) == parse_entry_regex(line)
+    if parse_entry(line):
+        assert parse_entry(line)[:2] == parse_line(line)
+
+
+def test_parse_entry():
+    line = make_log_line('/test', 0.5).encode('utf-8')
+
+    assert parse_entry(line) == LogEntry('/test', 0.5, 200, 660,
+                                         '01/Jan/1970:11:11:11 +0300')
+
+
+# separators, digits and unicode whitespace the regex treats as \s
+MUTATION_CHARS = ' "[]\t.0123456789x-/\n\r\xe9\xa0\x85\u2028\x0b\u0663'
+
+
+def gen_mutated_lines(count, seed=1):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        line = UI_SHORT_LINE
+        for _ in range(rnd.randint(1, 3)):
+            i = rnd.randrange(len(line))
+            char = rnd.choice(MUTATION_CHARS)
+            line = rnd.choice([line[:i] + line[i + 1:],
+                               line[:i] + char + line[i:],
+                               line[:i] + char + line[i + 1:]])
+        yield line.encode('utf-8')
+
+
+def test_parse_line_fuzz_parity(tmpdir):
+    lines = list(gen_mutated_lines(20000))
+
+    for line in lines:
+        assert parse_line(line) == parse_line_regex(line), line
+        assert parse_entry(line) == parse_entry_regex(line), line
+
+    lines = [line for line in lines if line.find(b'\n') == len(line) - 1]
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    with open(log_path, 'wb') as file:
+        file.writelines(lines)
+    assert list(gen_parse_mapped(log_path)) == [parse_line_regex(line) for line in lines]
+
+
+@pytest.mark.parametrize('live', [False, True])
+@pytest.mark.parametrize('window_size', [1, 100, 1024 * 1024])
+def test_gen_parse_mapped(tmpdir, monkeypatch, window_size, live):
+    monkeypatch.setattr(readers, 'WINDOW_SIZE', window_size)
+    lines = [line.encode('utf-8') for line in PARITY_LINES if line.endswith('\n')]
+    # the last line has no line break
+    lines.append(make_log_line('/last', 0.5).rstrip('\n').encode('utf-8'))
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    with open(log_path, 'wb') as file:
+        file.writelines(lines)
+
+    assert list(gen_parse_mapped(log_path, live=live)) == [parse_line(line) for line in lines]
+    assert list(gen_parse_log(log_path, live=live)) == [parse_line(line) for line in lines]
+
+    middle = sum(map(len, lines[:10]))
+    assert list(gen_parse_mapped(log_path, 0, middle, live)) + \
+        list(gen_parse_mapped(log_path, middle, live=live)) == \
+        [parse_line(line) for line in lines]
+    assert list(gen_parse_mapped(log_path, middle, middle, live)) == []
+
+    open(log_path, 'w').close()
+    assert list(gen_parse_mapped(log_path, live=live)) == []
+
+
+def test_gen_parse_live_truncated(tmpdir, monkeypatch):
+    monkeypatch.setattr(readers, 'WINDOW_SIZE', 1000)
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+
+    records = gen_parse_mapped(log_path, live=True)
+    next(records)
+    # copytruncate rotation while the log is parsed
+    open(log_path, 'w').close()
+    with pytest.raises(EOFError):
+        list(records)
+
+
+def test_create_report_live_not_mapped(tmpdir, monkeypatch):
+    log_dir, report_dir = tmpdir.mkdir('log'), tmpdir.mkdir('reports')
+    report_dir.join('report.html').write('$table_json')
+    write_test_log(str(log_dir.join('nginx-access-ui.log-20010101')))
+
+    def fail_mmap(*args, **kwargs):
+        raise AssertionError('live log must not be mapped')
+    monkeypatch.setattr(readers.mmap, 'mmap', fail_mmap)
+
+    for workers in (1, 2):
+        cfg = dict(log_analyzer.config, LOG_DIR=str(log_dir), REPORT_DIR=str(report_dir),
+                   WORKERS=workers, INCREMENTAL=True)
+        create_report(cfg)
+        report_dir.join('report-2001.01.01.html').remove()
+        create_report(dict(cfg, INCREMENTAL=False, DIMENSIONS=['status']), live=True)
+        report_dir.join('report-2001.01.01.html').remove()
+
+
+def test_generate_report_incremental(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    state_file = str(tmpdir.join('report-2001.01.01.state.json'))
+    write_test_log(log_path, count=500)
+
+    first = generate_report_incremental(log_path, state_file, AggregateSpec(exact=True))
+    assert first == generate_report(log_path, gen_parse_log, AggregateSpec(exact=True))
+
+    # append complete lines and a partially written one
+    with open(log_path, 'a') as file:
+        file.write(make_log_line('/test/new', 0.5))
+        file.write(make_log_line('/test/1', 0.25))
+        file.write(make_log_line('/test/partial', 0.1)[:20])
+    generate_report_incremental(log_path, state_file, AggregateSpec(exact=True))
+    with open(log_path, 'a') as file:
+        file.write(make_log_line('/test/partial', 0.1)[20:])
+    updated = generate_report_incremental(log_path, state_file, AggregateSpec(exact=True),
+                                          workers=2)
+
+    assert updated == generate_report(log_path, gen_parse_log, AggregateSpec(exact=True))
+    urls = [row['url'] for row in updated]
+    assert '/test/new' in urls and '/test/partial' in urls
+
+
+def test_generate_report_incremental_restart(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    state_file = str(tmpdir.join('report-2001.01.01.state.json'))
+    write_test_log(log_path, count=500)
+    generate_report_incremental(log_path, state_file)
+
+    # log was rotated and a shorter one took its place
+    os.remove(log_path)
+    write_test_log(log_path, count=100)
+    report = generate_report_incremental(log_path, state_file)
+
+    assert sum(row['count'] for row in report) == 100
+
+
+def test_get_logs(tmpdir):
+    for name in ('nginx-access-ui.log-20010103.gz', 'nginx-access-ui.log-20010101',
+                 'nginx-access-ui.log-20010102', 'nginx-access-ui.log-20010104'):
+        tmpdir.join(name).write('')
+
+    logs = get_logs(str(tmpdir), date(2001, 1, 2), date(2001, 1, 3))
+
+    assert [log.date for log in logs] == [date(2001, 1, 2), date(2001, 1, 3)]
+
+
+def test_generate_range_report(tmpdir, monkeypatch):
+    logs = []
+    for day in range(1, 4):
+        log = Log(str(tmpdir.join('nginx-access-ui.log-2001010{}.gz'.format(day))),
+                  date(2001, 1, day))
+        write_test_log(log.path, count=100 * day)
+        logs.append(log)
+
+    report = generate_range_report(logs, str(tmpdir), AggregateSpec(exact=True), workers=2)
+
+    assert sum(row['count'] for row in report) == 600
+    assert len(tmpdir.listdir(lambda path: path.basename.startswith('aggregate-'))) == 3
+
+    # cached aggregates are used instead of parsing logs
+    def fail_parse(log_path):
+        raise AssertionError('log must not be parsed')
+    monkeypatch.setattr(log_analyzer, 'gen_parse_log', fail_parse)
+    assert generate_range_report(logs, str(tmpdir), AggregateSpec(exact=True)) == report
+
+    # and dropped once the log has changed
+    monkeypatch.undo()
+    write_test_log(logs[0].path, count=50)
+    cache_file = str(tmpdir.join('aggregate-2001.01.01.json.gz'))
+    assert aggregate_log(logs[0].path, cache_file, AggregateSpec(exact=True)).total_count == 50
+
+
+def test_compact_aggregate(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+    records = list(gen_parse_log(log_path))
+
+    plain = LogAggregate(exact=True)
+    for record in records:
+        plain.add(record)
+    compact, tail = CompactAggregate(), CompactAggregate()
+    for record in records[:300]:
+        compact.add(record)
+    for record in records[300:]:
+        tail.add(record)
+    compact.merge(tail)
+
+    assert compact.errors_count == plain.errors_count == 1
+    assert compact.total_count == plain.total_count
+    assert build_report(compact) == build_report(plain)
+    restored = load_aggregate(json.loads(json.dumps(compact.dump())))
+    assert build_report(restored) == build_report(plain)
+
+
+@pytest.mark.parametrize('extension, compress', [('.gz', gzip.compress),
+                                                 ('.bz2', bz2.compress),
+                                                 ('.xz', lzma.compress)])
+def test_gen_log_lines(tmpdir, monkeypatch, extension, compress):
+    monkeypatch.setattr(readers, 'CHUNK_SIZE', 64)
+    lines = [make_log_line('/test/{}'.format(i), i / 1000).encode('utf-8')
+             for i in range(300)]
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101' + extension))
+    # two concatenated streams, the last line has no line break
+    with open(log_path, 'wb') as file:
+        file.write(compress(b''.join(lines[:100])))
+        file.write(compress(b''.join(lines[100:]).rstrip(b'\n')))
+
+    assert list(gen_log_lines(log_path)) == lines[:-1] + [lines[-1].rstrip(b'\n')]
+
+
+@pytest.mark.parametrize('extension, compress', [('.gz', gzip.compress),
+                                                 ('.bz2', bz2.compress),
+                                                 ('.xz', lzma.compress)])
+@pytest.mark.parametrize('trailer', [None, b'garbage'])
+def test_gen_log_lines_truncated(tmpdir, monkeypatch, extension, compress, trailer):
+    monkeypatch.setattr(readers, 'CHUNK_SIZE', 64)
+    data = compress(b''.join(make_log_line('/test/{}'.format(i), i / 1000).encode('utf-8')
+                             for i in range(1000)))
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101' + extension))
+    with open(log_path, 'wb') as file:
+        file.write(data + trailer if trailer else data[:len(data) // 2])
+
+    with pytest.raises(Exception):
+        list(gen_log_lines(log_path))
+
+
+def test_gen_log_lines_error(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101.gz'))
+    with open(log_path, 'wb') as file:
+        file.write(b'not a gzip file')
+
+    with pytest.raises(Exception):
+        list(gen_log_lines(log_path))
+
+
+@pytest.mark.parametrize('report_size', [None, 3])
+def test_build_report_numpy(tmpdir, report_size):
+    pytest.importorskip('numpy')
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path, count=2000)
+    with open(log_path, 'a') as file:
+        file.write(make_log_line('/single', 50) + make_log_line('/pair', 30) +
+                   make_log_line('/pair', 10) + make_log_line('/heavy', 100) * 3)
+
+    python = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True),
+                             report_size=report_size)
+    vectorized = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True),
+                                 report_size=report_size, use_numpy=True)
+
+    assert len(vectorized) == len(python)
+    python = {row['url']: row for row in python}
+    for row in vectorized:
+        assert row == pytest.approx(python[row['url']])
+        assert all(type(value) in (str, int, float) for value in row.values())
+
+
+def test_generate_report_top(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+
+    full = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True))
+    top = generate_report(log_path, gen_parse_log, AggregateSpec(exact=True), report_size=3)
+
+    assert top == sorted(full, key=lambda i: i['time_sum'], reverse=True)[:3]
+
+
+def test_write_report(tmpdir):
+    template = '<script>var table = $table_json; var price = $$5; ${table_json}</script>$other'
+    tmpdir.join('report.html').write(template)
+    report_file = str(tmpdir.join('report-2001.01.01.html'))
+    report = [{'url': '/test/{}'.format(i), 'time_sum': i % 4 + i / 100} for i in range(10)]
+    cfg = {'REPORT_DIR': str(tmpdir), 'REPORT_SIZE': 5}
+
+    write_report(cfg, report, report_file)
+
+    table = sorted(report, key=lambda i: i['time_sum'], reverse=True)[:5]
+    with open(report_file) as file:
+        assert file.read() == Template(template).safe_substitute({'table_json': table})
+
+
+def test_url_normalizer():
+    normalizer = UrlNormalizer([[r'(?<=/)\d+(?=/|\?|$)', '{id}']], strip_query=True)
+
+    assert normalizer('/api/v2/banner/12345') == '/api/v2/banner/{id}'
+    assert normalizer('/api/v2/banner/12345/info?id=1') == '/api/v2/banner/{id}/info'
+    assert normalizer('/api/v2/banner2/12a') == '/api/v2/banner2/12a'
+
+
+def test_generate_report_normalized(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+    normalizer = UrlNormalizer([[r'(?<=/)\d+$', '{id}']])
+
+    report = generate_report(log_path, gen_parse_log, AggregateSpec(normalizer=normalizer),
+                             workers=2)
+
+    assert len(report) == 1
+    assert report[0]['url'] == '/test/{id}'
+    assert report[0]['count'] == 1000
+
+
+def test_heavy_hitters_aggregate():
+    random.seed(2)
+    records = [LogRecord('/heavy/{}'.format(i % 5), 1.0) for i in range(5000)]
+    records += [LogRecord('/light/{}'.format(i), 0.01) for i in range(5000)]
+    random.shuffle(records)
+
+    aggregate, tail = HeavyHittersAggregate(50), HeavyHittersAggregate(50)
+    for record in records[:7000]:
+        aggregate.add(record)
+    for record in records[7000:]:
+        tail.add(record)
+    aggregate.merge(tail)
+    restored = load_aggregate(json.loads(json.dumps(aggregate.dump())))
+
+    for aggregate in (aggregate, restored):
+        assert len(aggregate.urls) <= 50
+        assert aggregate.total_count == len(records)
+        assert aggregate.total_time == pytest.approx(5050)
+        report = build_report(aggregate, report_size=5)
+        assert sorted(row['url'] for row in report) == ['/heavy/{}'.format(i) for i in range(5)]
+        for row in report:
+            assert row['time_sum'] <= 1000 <= row['time_sum'] + row['time_sum_error']
+            assert row['time_sum_error'] == aggregate.errors.get(row['url'], 0)
+
+
+def test_heavy_hitters_merge_error():
+    aggregate, other = HeavyHittersAggregate(2), HeavyHittersAggregate(2)
+    for record in [LogRecord('/u', 10), LogRecord('/a', 100), LogRecord('/b', 100)]:
+        aggregate.add(record)
+    other.add(LogRecord('/u', 200))
+
+    for merged in (HeavyHittersAggregate(2).merge(aggregate).merge(other),
+                   HeavyHittersAggregate(2).merge(other).merge(aggregate)):
+        # /u evicted by the first summary has true time_sum 210
+        assert merged.urls['/u'].sum == 200
+        assert merged.estimate('/u') >= 210
+        row, = [row for row in build_report(merged) if row['url'] == '/u']
+        assert row['time_sum'] + row['time_sum_error'] >= 210
+
+
+def test_generate_report_time_sum_error(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+
+    assert all('time_sum_error' not in row
+               for row in generate_report(log_path, gen_parse_log))
+    report = generate_report(log_path, gen_parse_log, AggregateSpec(top_urls=3, dimensions=('status',)))
+    assert len(report) == 3
+    assert all(row['time_sum_error'] >= 0 for row in report)
+    assert any(row['time_sum_error'] > 0 for row in report)
+
+
+def test_bench_generate_log(tmpdir):
+    first, second = str(tmpdir.join('first.gz')), str(tmpdir.join('second.gz'))
+    bench.generate_log(first, 2000, 100, 0.05, seed=1)
+    bench.generate_log(second, 2000, 100, 0.05, seed=1)
+
+    lines = list(gen_log_lines(first))
+    assert lines == list(gen_log_lines(second))
+    assert len(lines) == 2000
+    records = [parse_line_regex(line) for line in lines]
+    assert 50 < records.count(None) < 150
+    assert len({record.url for record in records if record}) <= 100
+
+
+@pytest.mark.parametrize('stage', bench.STAGES)
+def test_bench_run_stage(tmpdir, stage):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    bench.generate_log(log_path, 500, 50, 0.01)
+
+    result = bench.run_stage(stage, log_path, {'report_size': 10})
+
+    assert result['stage'] == stage
+    assert result['items'] > 0
+    assert result['seconds'] >= 0
+
+
+def test_bench_measure_stage_failure(tmpdir, monkeypatch):
+    monkeypatch.setattr(bench, 'POLL_INTERVAL', 0.1)
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    bench.generate_log(log_path, 10, 5, 0)
+
+    result = bench.measure_stage('parse', log_path, {})
+    assert result['items'] == 10
+    assert 0 < result['setup_rss_mb'] <= result['peak_rss_mb']
+    assert result['stage_rss_mb'] == result['peak_rss_mb'] - result['setup_rss_mb']
+    # the stage process dies on unknown stage
+    with pytest.raises(RuntimeError):
+        bench.measure_stage('unknown', log_path, {})
+
+
+def test_create_report_metrics(tmpdir):
+    log_dir, report_dir = tmpdir.mkdir('log'), tmpdir.mkdir('reports')
+    report_dir.join('report.html').write('<script>var table = $table_json;</script>')
+    write_test_log(str(log_dir.join('nginx-access-ui.log-20010101.gz')))
+    cfg = dict(log_analyzer.config, LOG_DIR=str(log_dir), REPORT_DIR=str(report_dir),
+               SAMPLE_LINES=0)
+    run_metrics.reset()
+
+    create_report(cfg)
+
+    assert report_dir.join('report-2001.01.01.html').check()
+    with open(str(report_dir.join('report-2001.01.01.metrics.json'))) as file:
+        metrics = json.load(file)
+    for stage in ('get_last_log', 'generate_report', 'gen_parse_log',
+                  'decompress', 'calc_time', 'write_report'):
+        assert metrics['stages'][stage]['calls'] >= 1
+    assert metrics['counters']['lines'] == 1001
+    assert metrics['counters']['parse_errors'] == 1
+    assert metrics['counters']['unique_urls'] == 7
+    assert metrics['counters']['bytes_read'] == os.path.getsize(
+        str(log_dir.join('nginx-access-ui.log-20010101.gz')))
+    assert metrics['peak_rss_mb'] > 0
+
+
+def write_broken_log(path, count=1000, broken_from=0):
+    lines = [make_log_line('/test/{}'.format(i % 7), 0.1) if i < broken_from
+             else 'changed format {}\n'.format(i) for i in range(count)]
+    with open(path, 'w') as file:
+        file.writelines(lines)
+
+
+def test_validate_log(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_test_log(log_path)
+    validate_log(log_path, 30, 0.2)
+
+    # only the tail is broken
+    write_broken_log(log_path, broken_from=900)
+    assert len(sample_log(log_path, 30)) == 30
+    with pytest.raises(ErrorRateExceeded):
+        validate_log(log_path, 30, 0.2)
+
+
+def test_generate_report_error_rate(tmpdir, monkeypatch):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_broken_log(log_path, count=5000, broken_from=2000)
+    monkeypatch.setattr(log_analyzer, 'ERROR_CHECK_LINES', 100)
+
+    parsed = []
+
+    def parser(log_path, entries=False, live=False):
+        for record in gen_parse_log(log_path, entries, live):
+            parsed.append(record)
+            yield record
+
+    with pytest.raises(ErrorRateExceeded):
+        generate_report(log_path, parser, AggregateSpec(error_rate=0.2))
+    assert len(parsed) < 5000
+
+    with pytest.raises(ErrorRateExceeded):
+        generate_report(log_path, gen_parse_log, AggregateSpec(error_rate=0.2), workers=2)
+
+    assert generate_report(log_path, gen_parse_log, AggregateSpec(error_rate=0.7))
+
+
+def test_create_report_broken_log(tmpdir):
+    log_dir, report_dir = tmpdir.mkdir('log'), tmpdir.mkdir('reports')
+    report_dir.join('report.html').write('$table_json')
+    write_broken_log(str(log_dir.join('nginx-access-ui.log-20010101')), broken_from=500)
+    cfg = dict(log_analyzer.config, LOG_DIR=str(log_dir), REPORT_DIR=str(report_dir))
+
+    create_report(cfg)
+
+    assert not report_dir.join('report-2001.01.01.html').check()
+
+
+def test_log_index(tmpdir, monkeypatch):
+    index = LogIndex(str(tmpdir))
+    assert index.scan()
+    assert index.get_last_log() == Log(None, None)
+    assert not index.scan()
+
+    tmpdir.join('nginx-access-ui.log-20010101').write('')
+    tmpdir.join('nginx-access-ui.log-20040101.zip').write('')
+    assert index.scan()
+    assert index.get_last_log() == Log(str(tmpdir.join('nginx-access-ui.log-20010101')),
+                                       date(2001, 1, 1))
+
+    # known names aren't parsed again
+    parsed = []
+    parse_log_name = log_analyzer.parse_log_name
+    monkeypatch.setattr(log_analyzer, 'parse_log_name',
+                        lambda *args: parsed.append(args) or parse_log_name(*args))
+    tmpdir.join('nginx-access-ui.log-20020101.gz').write('')
+    tmpdir.join('nginx-access-ui.log-20010101').remove()
+    assert index.scan()
+    assert parsed == [(str(tmpdir), 'nginx-access-ui.log-20020101.gz')]
+    assert index.get_last_log().date == date(2002, 1, 1)
+
+
+def wait_for(check, timeout=10):
+    for _ in range(int(timeout / 0.01)):
+        if check():
+            return True
+        sleep(0.01)
+    return False
+
+
+def test_watch(tmpdir):
+    log_dir, report_dir = tmpdir.mkdir('log'), tmpdir.mkdir('reports')
+    report_dir.join('report.html').write('$table_json')
+    write_test_log(str(log_dir.join('nginx-access-ui.log-20010101')))
+    cfg = dict(log_analyzer.config, LOG_DIR=str(log_dir), REPORT_DIR=str(report_dir),
+               WATCH_INTERVAL=0.01)
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch, args=(cfg, stop))
+    watcher.start()
+    try:
+        assert wait_for(report_dir.join('report-2001.01.01.html').check)
+        # rotated log appears at once
+        write_test_log(str(tmpdir.join('rotated.gz')))
+        tmpdir.join('rotated.gz').move(log_dir.join('nginx-access-ui.log-20010102.gz'))
+        assert wait_for(report_dir.join('report-2001.01.02.html').check)
+    finally:
+        stop.set()
+        watcher.join()
+
+
+def test_watch_log_being_compressed(tmpdir):
+    log_dir, report_dir = tmpdir.mkdir('log'), tmpdir.mkdir('reports')
+    report_dir.join('report.html').write('$table_json')
+    write_test_log(str(tmpdir.join('rotated.gz')))
+    data = tmpdir.join('rotated.gz').read_binary()
+    log_path = log_dir.join('nginx-access-ui.log-20010102.gz')
+    # logrotate has written only a part of the log yet
+    log_path.write_binary(data[:len(data) // 2])
+    cfg = dict(log_analyzer.config, LOG_DIR=str(log_dir), REPORT_DIR=str(report_dir),
+               WATCH_INTERVAL=0.01)
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch, args=(cfg, stop))
+    watcher.start()
+    try:
+        sleep(0.2)
+        assert not report_dir.join('report-2001.01.02.html').check()
+        log_path.write_binary(data)
+        assert wait_for(report_dir.join('report-2001.01.02.html').check)
+        report = ast.literal_eval(report_dir.join('report-2001.01.02.html').read())
+        assert sum(row['count'] for row in report) == 1000
+    finally:
+        stop.set()
+        watcher.join()
+
+
+def write_dimensions_log(path):
+    lines = ['1.2.3.4 - - [01/Jan/1970:11:{:02d}:11 +0300] "GET /test/{} HTTP/1.1" '
+             '{} {} "-" "-" "-" "-" "-" {}\n'.format(i // 100, i % 7, 404 if i % 10 else 200,
+                                                    i % 1000, (i % 13) / 8)
+             for i in range(1000)]
+    lines.insert(500, 'broken line\n')
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as file:
+        file.writelines(lines)
+
+
+@pytest.mark.parametrize('log_name', ['nginx-access-ui.log-20010101',
+                                      'nginx-access-ui.log-20010101.gz'])
+def test_generate_report_dimensions(tmpdir, log_name):
+    log_path = str(tmpdir.join(log_name))
+    write_dimensions_log(log_path)
+    spec = AggregateSpec(dimensions=('status', 'latency', 'bytes'))
+
+    report = generate_report(log_path, gen_parse_log, spec)
+
+    assert report == generate_report(log_path, gen_parse_log)
+    assert report.dimensions['status'] == [
+        {"status": 200, "count": 100, "count_perc": 10.0},
+        {"status": 404, "count": 900, "count_perc": 90.0}]
+    latency = report.dimensions['latency']
+    assert [row['minute'] for row in latency] == [
+        '1970-01-01T11:{:02d}:00'.format(minute) for minute in range(10)]
+    assert all(row['count'] == 100 for row in latency)
+    assert latency[0]['time_max'] == 1.5
+    assert report.dimensions['bytes'] == {
+        "count": 1000, "bytes_sum": 499500, "bytes_avg": 499.5, "bytes_max": 999}
+
+    for parallel in (generate_report(log_path, gen_parse_log, spec, workers=3),
+                     generate_range_report([Log(log_path, date(2001, 1, 1))], str(tmpdir),
+                                           spec)):
+        assert parallel == report
+        assert parallel.dimensions == report.dimensions
+
+
+def test_latency_dimension_invalid_time(tmpdir, caplog):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    write_dimensions_log(log_path)
+    with open(log_path, 'a') as file:
+        file.write('1.2.3.4 - - [-] "GET /test/1 HTTP/1.1" 200 1 '
+                   '"-" "-" "-" "-" "-" 0.5\n')
+
+    spec = AggregateSpec(dimensions=('latency',))
+    report = generate_report(log_path, gen_parse_log, spec)
+
+    assert [row['count'] for row in report.dimensions['latency']] == [100] * 10
+    assert 'skipped 1 entries with invalid $time_local' in caplog.text
+    for parallel in (generate_report(log_path, gen_parse_log, spec, workers=3),
+                     generate_range_report([Log(log_path, date(2001, 1, 1))], str(tmpdir),
+                                           spec)):
+        assert parallel.dimensions == report.dimensions
+    dimension = DIMENSIONS['latency']()
+    dimension.add(LogEntry('/test', 0.5, 200, 1, '-'))
+    dimension.add(LogEntry('/test', 0.5, 200, 1, '01/Jan/1970:11:00:11 +0300'))
+    loaded = DIMENSIONS['latency'].load(json.loads(json.dumps(dimension.dump())))
+    assert loaded.invalid_count == 1
+    assert loaded.report() == dimension.report()
+    # dump of older versions holds minutes only
+    assert DIMENSIONS['latency'].load(dimension.dump()['minutes']).report() == dimension.report()
+
+
+def test_generate_report_incremental_dimensions(tmpdir):
+    log_path = str(tmpdir.join('nginx-access-ui.log-20010101'))
+    state_file = str(tmpdir.join('state.json'))
+    write_dimensions_log(log_path)
+    with open(log_path, 'rb') as file:
+        lines = file.readlines()
+    with open(log_path, 'wb') as file:
+        file.writelines(lines[:300])
+
+    spec = AggregateSpec(dimensions=('status', 'latency'))
+    generate_report_incremental(log_path, state_file, spec)
+    with open(log_path, 'ab') as file:
+        file.writelines(lines[300:])
+    report = generate_report_incremental(log_path, state_file, spec)
+
+    full = generate_report(log_path, gen_parse_log, spec)
+    assert report == full
+    assert report.dimensions == full.dimensions
+
+
+def test_create_report_dimensions(tmpdir):
+    log_dir, report_dir = tmpdir.mkdir('log'), tmpdir.mkdir('reports')
+    report_dir.join('report.html').write('$table_json')
+    write_dimensions_log(str(log_dir.join('nginx-access-ui.log-20010101')))
+    cfg = dict(log_analyzer.config, LOG_DIR=str(log_dir), REPORT_DIR=str(report_dir),
+               DIMENSIONS=['status'])
+
+    create_report(cfg)
+
+    with open(str(report_dir.join('report-2001.01.01.dimensions.json'))) as file:
+        assert json.load(file)['status'][0]['status'] == 200
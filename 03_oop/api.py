@@ -2,32 +2,33 @@
 # -*- coding: utf-8 -*-
 
 import json
-import datetime
-import hashlib
+import time
 import uuid
+import socket
 import logging
+import selectors
+import threading
+from collections import OrderedDict, deque
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
 from http import HTTPStatus
 
 from requests import MethodRequest, OnlineScoreRequest, ClientsInterestsRequest
-from scoring import get_score, get_interests
-from consts import ADMIN_SALT, SALT, ADMIN_LOGIN
+from scoring import get_score, get_interests_many
+from auth import check_auth
+from store import Store, TIMEOUT as STORE_TIMEOUT
 from errors_const import ERRORS
 
 
+WORKERS = 10
+MAX_CONNECTIONS = 100
+KEEPALIVE_TIMEOUT = 5
+BATCH_WORKERS = 10
+MAX_BATCH_SIZE = 1000
 
-def check_auth(request):
-    if request.is_admin:
-        digest = hashlib.sha512(str(datetime.datetime.now().strftime(
-            "%Y%m%d%H") + ADMIN_SALT).encode('utf-8')).hexdigest()
-    else:
-        digest = hashlib.sha512(
-            str(request.account + request.login + SALT).encode('utf-8')).hexdigest()
-    if digest == request.token:
-        return True
-    return False
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
 
 
 def online_score_handler(arguments, ctx, store):
@@ -43,10 +44,9 @@ def online_score_handler(arguments, ctx, store):
     else:
         score = get_score(
             store=store,
-            phone=str(arguments.phone),
+            phone=arguments.phone,
             email=arguments.email,
-            birthday=arguments.birthday and datetime.datetime.strptime(
-                arguments.birthday, '%d.%m.%Y'),
+            birthday=arguments.birthday,
             gender=arguments.gender,
             first_name=arguments.first_name,
             last_name=arguments.last_name
@@ -64,12 +64,16 @@ def clients_interests_handler(arguments, ctx, store):
     ctx['nclients'] = len(arguments.client_ids)
 
     try:
-        return {client_id: get_interests(store, client_id) for client_id in arguments.client_ids}, HTTPStatus.OK
+        interests, errors = get_interests_many(store, arguments.client_ids)
     except Exception as e:
         return {'error': str(e)}, HTTPStatus.UNPROCESSABLE_ENTITY
 
+    # a client failed alone doesn't fail the others
+    interests.update((client_id, {'error': error}) for client_id, error in errors.items())
+    return interests, HTTPStatus.OK
+
 
-def method_handler(request, ctx, store):
+def method_handler(request, ctx, store, auth=check_auth):
 
     methods = {
         'online_score': online_score_handler,
@@ -81,7 +85,7 @@ def method_handler(request, ctx, store):
     if not method_request.is_valid:
         return ', '.join(method_request.errors), HTTPStatus.UNPROCESSABLE_ENTITY
 
-    if not check_auth(method_request):
+    if not auth(method_request):
         return ERRORS[HTTPStatus.FORBIDDEN], HTTPStatus.FORBIDDEN
 
     method = methods.get(method_request.method)
@@ -93,9 +97,75 @@ def method_handler(request, ctx, store):
     return method(method_request.arguments, ctx, store)
 
 
+def batch_handler(request, ctx, store):
+    """ Handle a list of method requests concurrently, the response is
+    the list of their {"code", "response" or "error"} in the same order.
+    Credentials are checked once per batch """
+
+    items = request['body']
+    if not isinstance(items, list):
+        return 'batch must be a list of method requests', HTTPStatus.UNPROCESSABLE_ENTITY
+    if len(items) > MAX_BATCH_SIZE:
+        return f'batch is larger than {MAX_BATCH_SIZE}', HTTPStatus.UNPROCESSABLE_ENTITY
+
+    checked = {}
+
+    def auth(method_request):
+        credentials = (method_request.account, method_request.login, method_request.token)
+        if credentials not in checked:
+            checked[credentials] = check_auth(method_request)
+        return checked[credentials]
+
+    def handle(item):
+        item_ctx = {}
+        try:
+            response, code = method_handler({"body": item, "headers": request['headers']},
+                                            item_ctx, store, auth)
+        except Exception as e:
+            logging.exception(f"Unexpected error: {e}")
+            response, code = {}, HTTPStatus.UNPROCESSABLE_ENTITY
+        return make_response(response, code)
+
+    ctx['nitems'] = len(items)
+    if len(items) < 2:
+        return [handle(item) for item in items], HTTPStatus.OK
+    return list(batch_executor.map(handle, items)), HTTPStatus.OK
+
+
+def route_request(router, path, request, headers, ctx, store):
+    """ Return (response, code) of the router handler of path """
+
+    path = path.strip("/")
+    if path not in router:
+        return {}, HTTPStatus.NOT_FOUND
+
+    try:
+        return router[path]({"body": request, "headers": headers}, ctx, store)
+    except Exception as e:
+        logging.exception(f"Unexpected error: {e}")
+        return {}, HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def make_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
+def build_response(response, code, ctx):
+    """ Return JSON response body """
+
+    r = make_response(response, code)
+    ctx.update(r)
+    logging.info(ctx)
+
+    return json.dumps(r).encode('utf-8')
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
-        "method": method_handler
+        "method": method_handler,
+        "batch": batch_handler,
     }
     store = None
 
@@ -113,33 +183,177 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         except Exception as e:
             logging.error(e)
             code = HTTPStatus.BAD_REQUEST
+            # the rest of the body may be left unread
+            self.close_connection = True
 
-        if request:
-            path = self.path.strip("/")
+        if request is not None:
             logging.info("%s: %s %s" %
                          (self.path, data_string, context["request_id"]))
-            if path in self.router:
-                try:
-                    response, code = self.router[path](
-                        {"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception(f"Unexpected error: {e}")
-                    code = HTTPStatus.UNPROCESSABLE_ENTITY
-            else:
-                code = HTTPStatus.NOT_FOUND
+            response, code = route_request(self.router, self.path, request,
+                                           self.headers, context, self.store)
 
+        body = build_response(response, code, context)
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(
-                code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
+        self.wfile.write(body)
+
+
+def get_store(address, timeout=STORE_TIMEOUT):
+    """ Return Store at host:port address or None if address is empty """
+
+    if not address:
+        return None
+    host, _, port = address.rpartition(':')
+    return Store(host, int(port), timeout)
+
+
+class KeepAliveHTTPHandler(MainHTTPHandler):
+    """ MainHTTPHandler keeping HTTP/1.1 connection open for next requests.
+    Only requests already received are handled, then the connection is
+    handed back to the server to wait for the next one without a worker.
+    A request not received in server keepalive_timeout seconds closes it """
+
+    protocol_version = "HTTP/1.1"
 
-        self.wfile.write(json.dumps(r).encode('utf-8'))
+    def setup(self):
+        self.timeout = self.server.keepalive_timeout
+        super(KeepAliveHTTPHandler, self).setup()
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.request_buffered():
+            self.handle_one_request()
+
+    def request_buffered(self):
+        """ Return True if the next request has started to arrive """
+
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class PooledHTTPServer(HTTPServer):
+    """ HTTPServer handling requests in a pool of worker threads.
+    At most max_connections connections are accepted at once,
+    the rest wait in the listen queue. A keep-alive connection between
+    requests waits in a selector, not in a worker, and is closed when
+    idle for keepalive_timeout seconds """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=WORKERS,
+                 max_connections=MAX_CONNECTIONS, keepalive_timeout=KEEPALIVE_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.connections = threading.BoundedSemaphore(max_connections)
+        self.keepalive_timeout = keepalive_timeout
+        # {socket: (client_address, idle deadline)} in the order of deadlines
+        self.idle = OrderedDict()
+        self.parked = deque()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.wakeup_writer = socket.socketpair()
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.closed = False
+        super(PooledHTTPServer, self).__init__(server_address, handler_class)
+        self.idle_thread = threading.Thread(target=self.serve_idle, daemon=True)
+        self.idle_thread.start()
+
+    def get_request(self):
+        # OSError makes serve_forever just poll again
+        if not self.connections.acquire(timeout=0.5):
+            raise OSError('too many connections')
+        try:
+            return super(PooledHTTPServer, self).get_request()
+        except Exception:
+            self.connections.release()
+            raise
+
+    def process_request(self, request, client_address):
+        # a worker is taken once the request starts to arrive
+        self.park(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        else:
+            if not handler.close_connection:
+                self.park(request, client_address)
+                return
+        self.release_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def release_request(self, request):
+        self.shutdown_request(request)
+        self.connections.release()
+
+    def park(self, request, client_address):
+        """ Pass connection waiting for its next request to serve_idle """
+
+        if self.closed:
+            self.release_request(request)
+            return
+        self.parked.append((request, client_address))
+        self.wakeup_writer.send(b'\0')
+
+    def serve_idle(self):
+        """ Thread, submit connections with the next request to workers
+        and close the ones idle for keepalive_timeout """
+
+        while not self.closed:
+            timeout = None
+            if self.idle:
+                _, deadline = next(iter(self.idle.values()))
+                timeout = max(deadline - time.monotonic(), 0)
+
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                client_address, _ = self.idle.pop(key.fileobj)
+                self.executor.submit(self.process_request_thread, key.fileobj,
+                                     client_address)
+
+            while self.parked:
+                request, client_address = self.parked.popleft()
+                self.idle[request] = (client_address,
+                                      time.monotonic() + self.keepalive_timeout)
+                self.selector.register(request, selectors.EVENT_READ)
+
+            now = time.monotonic()
+            while self.idle:
+                request, (_, deadline) = next(iter(self.idle.items()))
+                if deadline > now:
+                    break
+                del self.idle[request]
+                self.selector.unregister(request)
+                self.release_request(request)
+
+    def server_close(self):
+        super(PooledHTTPServer, self).server_close()
+        self.closed = True
+        self.wakeup_writer.send(b'\0')
+        self.idle_thread.join()
+        for request in list(self.idle) + [request for request, _ in self.parked]:
+            self.release_request(request)
+        self.idle.clear()
+        self.parked.clear()
+        self.selector.close()
+        self.wakeup.close()
+        self.wakeup_writer.close()
+        self.executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
@@ -147,11 +361,27 @@ if __name__ == "__main__":
     ap.add_argument(
         "-p", "--port", action="store", type=int, default=8080)
     ap.add_argument("-l", "--log", action="store", default=None)
+    ap.add_argument("-w", "--workers", action="store", type=int, default=WORKERS,
+                    help="worker threads, 0 serves one connection at a time")
+    ap.add_argument("--max-connections", action="store", type=int,
+                    default=MAX_CONNECTIONS)
+    ap.add_argument("--keepalive-timeout", action="store", type=float,
+                    default=KEEPALIVE_TIMEOUT)
+    ap.add_argument("-s", "--store", action="store", default=None,
+                    help="key-value store address, host:port")
+    ap.add_argument("--store-timeout", action="store", type=float,
+                    default=STORE_TIMEOUT)
     args = ap.parse_args()
 
     logging.basicConfig(filename=args.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", args.port), MainHTTPHandler)
+    MainHTTPHandler.store = get_store(args.store, args.store_timeout)
+    if args.workers:
+        server = PooledHTTPServer(("localhost", args.port), KeepAliveHTTPHandler,
+                                  args.workers, args.max_connections,
+                                  args.keepalive_timeout)
+    else:
+        server = HTTPServer(("localhost", args.port), MainHTTPHandler)
 
     logging.info("Starting server at %s" % args.port)
     try:
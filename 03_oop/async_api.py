@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import uuid
+import asyncio
+import logging
+import http.client
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from http import HTTPStatus
+
+from api import MainHTTPHandler, route_request, build_response, get_store, \
+    WORKERS, KEEPALIVE_TIMEOUT, STORE_TIMEOUT
+
+
+# idle connections are cheap here
+MAX_CONNECTIONS = 10000
+REQUEST_TIMEOUT = 10
+# request line and headers size limit
+MAX_HEADERS_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class AsyncHTTPServer(object):
+    """ HTTP/1.1 keep-alive server on asyncio, requests are routed through
+    MainHTTPHandler.router. An idle connection is a coroutine waiting
+    for data, not a thread. Handlers are synchronous and run in a pool of
+    workers threads, at most workers of them at once: a connection doesn't
+    read its next request until the current one is answered, and a request
+    not answered in request_timeout seconds gets 504 (or 503 if it hasn't
+    got a worker). A body larger than max_body_size gets 413, a connection
+    sending its headers or body longer than keepalive_timeout is closed """
+
+    def __init__(self, store=None, workers=WORKERS, max_connections=MAX_CONNECTIONS,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, request_timeout=REQUEST_TIMEOUT,
+                 max_body_size=MAX_BODY_SIZE):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.workers = asyncio.Semaphore(workers)
+        self.max_connections = max_connections
+        self.connections = 0
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.max_body_size = max_body_size
+
+    async def start(self, host, port):
+        """ Return started asyncio server """
+        return await asyncio.start_server(self.handle_connection, host, port,
+                                          limit=MAX_HEADERS_SIZE)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            logging.warning('Too many connections')
+            writer.close()
+            return
+
+        self.connections += 1
+        try:
+            while await self.handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.exception(f"Unexpected error: {e}")
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def read_request(self, reader):
+        """ Return (method, path, version, headers) of the next request
+        or None if connection is closed by client """
+
+        try:
+            data = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                          self.keepalive_timeout)
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise
+            return None
+
+        request_line, _, data = data.partition(b'\r\n')
+        method, path, version = request_line.decode('latin-1').split()
+        headers = http.client.parse_headers(io.BytesIO(data))
+        return method, path, version, headers
+
+    async def handle_request(self, reader, writer):
+        """ Read, route and answer one request,
+        return True if connection is kept open for the next one """
+
+        try:
+            request_head = await self.read_request(reader)
+        except (ValueError, asyncio.LimitOverrunError, http.client.HTTPException) as e:
+            logging.error(e)
+            await self.write_response(writer, {}, HTTPStatus.BAD_REQUEST, {}, True)
+            return False
+        if not request_head:
+            return False
+
+        method, path, version, headers = request_head
+        connection = headers.get('Connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' \
+            else connection != 'close'
+        context = {"request_id": headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)}
+
+        if method != 'POST':
+            await self.write_response(writer, {}, HTTPStatus.METHOD_NOT_ALLOWED,
+                                      context, True)
+            return False
+
+        try:
+            length = int(headers['Content-Length'])
+            if length < 0:
+                raise ValueError(f'Negative Content-Length {length}')
+        except (TypeError, ValueError) as e:
+            logging.error(e)
+            await self.write_response(writer, {}, HTTPStatus.BAD_REQUEST, context, True)
+            return False
+        if length > self.max_body_size:
+            logging.error(f'Body of {length} bytes is larger than {self.max_body_size}')
+            await self.write_response(writer, {}, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                      context, True)
+            return False
+
+        response, code, request = {}, HTTPStatus.OK, None
+        data_string = await asyncio.wait_for(reader.readexactly(length),
+                                             self.keepalive_timeout)
+        try:
+            request = json.loads(data_string.decode('utf-8'))
+        except Exception as e:
+            logging.error(e)
+            code = HTTPStatus.BAD_REQUEST
+            keep_alive = False
+
+        if request is not None:
+            logging.info("%s: %s %s" % (path, data_string, context["request_id"]))
+            response, code = await self.route(path, request, headers, context)
+
+        await self.write_response(writer, response, code, context, not keep_alive)
+        return keep_alive
+
+    async def route(self, path, request, headers, context):
+        """ Return (response, code) of request handled in a worker thread """
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+
+        try:
+            await asyncio.wait_for(self.workers.acquire(), self.request_timeout)
+        except asyncio.TimeoutError:
+            return {}, HTTPStatus.SERVICE_UNAVAILABLE
+
+        # the worker is busy until the handler returns, even after timeout
+        future = loop.run_in_executor(self.executor, route_request, MainHTTPHandler.router,
+                                      path, request, headers, context, self.store)
+        future.add_done_callback(lambda _: self.workers.release())
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future),
+                                          max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logging.error(f'Request {context["request_id"]} timed out')
+            return {}, HTTPStatus.GATEWAY_TIMEOUT
+
+    async def write_response(self, writer, response, code, context, close):
+        body = build_response(response, code, context)
+        head = [f'HTTP/1.1 {code.value} {code.phrase}',
+                'Content-Type: application/json',
+                f'Content-Length: {len(body)}']
+        if close:
+            head.append('Connection: close')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host, port, server):
+    async with await server.start(host, port) as asyncio_server:
+        logging.info("Starting asyncio server at %s" % port)
+        await asyncio_server.serve_forever()
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument(
+        "-p", "--port", action="store", type=int, default=8080)
+    ap.add_argument("-l", "--log", action="store", default=None)
+    ap.add_argument("-w", "--workers", action="store", type=int, default=WORKERS,
+                    help="threads running request handlers")
+    ap.add_argument("--max-connections", action="store", type=int,
+                    default=MAX_CONNECTIONS)
+    ap.add_argument("--keepalive-timeout", action="store", type=float,
+                    default=KEEPALIVE_TIMEOUT)
+    ap.add_argument("--request-timeout", action="store", type=float,
+                    default=REQUEST_TIMEOUT)
+    ap.add_argument("--max-body-size", action="store", type=int,
+                    default=MAX_BODY_SIZE)
+    ap.add_argument("-s", "--store", action="store", default=None,
+                    help="key-value store address, host:port")
+    ap.add_argument("--store-timeout", action="store", type=float,
+                    default=STORE_TIMEOUT)
+    args = ap.parse_args()
+
+    logging.basicConfig(filename=args.log, level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    server = AsyncHTTPServer(get_store(args.store, args.store_timeout), args.workers,
+                             args.max_connections, args.keepalive_timeout,
+                             args.request_timeout, args.max_body_size)
+    try:
+        asyncio.run(serve("localhost", args.port, server))
+    except KeyboardInterrupt:
+        pass
+    server.close()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import hmac
+import time
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+
+from consts import ADMIN_SALT, SALT
+
+
+AUTH_CACHE_SIZE = 10000
+
+
+def sha512(string):
+    """ Return hex digest as bytes, ready for hmac.compare_digest """
+    return hashlib.sha512(string.encode('utf-8')).hexdigest().encode('ascii')
+
+
+def admin_digest(hour):
+    return sha512(hour.strftime("%Y%m%d%H") + ADMIN_SALT)
+
+
+def user_digest(account, login):
+    return sha512(account + login + SALT)
+
+
+class Authenticator(object):
+    """ Checks request tokens against cached digests. Admin digests of
+    the current and the previous hour are recomputed once an hour, the
+    previous one is accepted so a token made just before the hour
+    rollover stays valid. Digests of verified account and login pairs
+    are kept in a LRU of size of them """
+
+    def __init__(self, size=AUTH_CACHE_SIZE):
+        self.size = size
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+        # (timestamp of the next hour, admin digests)
+        self.admin = (0, ())
+
+    def admin_digests(self):
+        next_hour, digests = self.admin
+        if time.time() >= next_hour:
+            hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+            digests = (admin_digest(hour), admin_digest(hour - datetime.timedelta(hours=1)))
+            next_hour = (hour + datetime.timedelta(hours=1)).timestamp()
+            self.admin = (next_hour, digests)
+        return digests
+
+    def check(self, request):
+        token = request.token
+        if not isinstance(token, str):
+            return False
+        token = token.encode('utf-8')
+
+        if request.is_admin:
+            return any([hmac.compare_digest(token, digest) for digest in self.admin_digests()])
+
+        key = request.account + request.login
+        digest = self.users.get(key)
+        if digest is not None:
+            try:
+                self.users.move_to_end(key)
+            except KeyError:
+                # evicted by another thread meanwhile
+                pass
+            return hmac.compare_digest(token, digest)
+
+        digest = user_digest(request.account, request.login)
+        if not hmac.compare_digest(token, digest):
+            return False
+        with self.lock:
+            self.users[key] = digest
+            if len(self.users) > self.size:
+                self.users.popitem(last=False)
+        return True
+
+
+authenticator = Authenticator()
+
+
+def check_auth(request):
+    return authenticator.check(request)
@@ -1,3 +1,7 @@
 # -*- coding: utf-8 -*-
 class ValidationError(Exception):
     pass
+
+
+class StoreError(Exception):
+    pass
@@ -1,13 +1,35 @@
 # -*- coding: utf-8 -*-
 
 import re
-from datetime import datetime
+import time
+from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 
 from exceptions import ValidationError
 from consts import UNKNOWN, GENDERS, EMAIL_PATTERN, PHONE_PATTERN, DATE_FORMAT
 
 
+EMAIL_RE = re.compile(EMAIL_PATTERN)
+PHONE_RE = re.compile(PHONE_PATTERN)
+MAX_AGE = 70
+
+# (timestamp of the next midnight, min birthday year)
+_age_limit = (0, None)
+
+
+def min_birthday_year():
+    """ Return the earliest allowed birthday year, computed once a day """
+
+    global _age_limit
+    next_day, year = _age_limit
+    if time.time() >= next_day:
+        today = date.today()
+        year = (today - relativedelta(years=MAX_AGE)).year
+        next_day = datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+        _age_limit = (next_day, year)
+    return year
+
+
 class Field(object):
 
     def __init__(self, type, nullable=False, required=False):
@@ -17,18 +39,32 @@ class Field(object):
         self.nullable = nullable
 
     def __set__(self, instance, value):
-        self.validate(value)
-        instance.__dict__[self.name] = value
+        value, error = self.clean(value)
+        if error is not None:
+            raise ValidationError(error)
+        instance._values[self.name] = value
 
     def __get__(self, instance, owner):
-        return instance.__dict__.get(self.name)
+        if instance is None:
+            return self
+        return instance._values.get(self.name)
 
     def validate(self, value):
+        error = self.clean(value)[1]
+        if error is not None:
+            raise ValidationError(error)
+
+    def clean(self, value):
+        """ Return (value converted to field type, None)
+        or (value, error message) if it's invalid """
+
         if not (value or self.nullable):
-            raise Exception(f'field {self.name} cannot be empty')
+            return value, f'field {self.name} cannot be empty'
 
         if not isinstance(value, self.type):
-            raise Exception(f'field {self.name}, invalid type {self.type}')
+            return value, f'field {self.name}, invalid type {self.type}'
+
+        return value, None
 
 
 class CharField(Field):
@@ -47,38 +83,50 @@ class EmailField(CharField):
     def __init__(self, required=False, nullable=True):
         super(EmailField, self).__init__(required=required, nullable=nullable)
 
-    def validate(self, value):
-        super(EmailField, self).validate(value)
+    def clean(self, value):
+        value, error = super(EmailField, self).clean(value)
+        if error is not None:
+            return value, error
 
-        if not re.match(EMAIL_PATTERN, str(value)):
-            raise ValidationError(f'invalid email address: {value}')
+        if not EMAIL_RE.match(value):
+            return value, f'invalid email address: {value}'
+        return value, None
 
 
 class PhoneField(Field):
+    """ Phone number, an int one is converted to str """
+
     def __init__(self, required=False, nullable=True):
         super(PhoneField, self).__init__(
             type=(int, str), required=required, nullable=nullable)
 
-    def validate(self, value):
-        super(PhoneField, self).validate(value)
+    def clean(self, value):
+        value, error = super(PhoneField, self).clean(value)
+        if error is not None:
+            return value, error
 
-        if not re.match(PHONE_PATTERN, str(value)):
-            raise ValidationError(f'invalid phone number: {value}')
+        value = str(value)
+        if not PHONE_RE.match(value):
+            return value, f'invalid phone number: {value}'
+        return value, None
 
 
 class DateField(Field):
+    """ Date in DATE_FORMAT converted to datetime.date """
+
     def __init__(self, required=False, nullable=True):
         super(DateField, self).__init__(type=str,
                                         required=required, nullable=nullable)
 
-    def validate(self, value):
-        super(DateField, self).validate(value)
+    def clean(self, value):
+        value, error = super(DateField, self).clean(value)
+        if error is not None or not value:
+            return value, error
 
-        if value:
-            try:
-                datetime.strptime(value, DATE_FORMAT)
-            except ValueError:
-                raise ValidationError(f'invalid date format: {value}')
+        try:
+            return datetime.strptime(value, DATE_FORMAT).date(), None
+        except ValueError:
+            return value, f'invalid date format: {value}'
 
 
 class BirthDayField(DateField):
@@ -86,18 +134,15 @@ class BirthDayField(DateField):
         super(BirthDayField, self).__init__(
             required=required, nullable=nullable)
 
-    def validate(self, value):
-        super(BirthDayField, self).validate(value)
+    def clean(self, value):
+        value, error = super(BirthDayField, self).clean(value)
+        if error is not None or not value:
+            return value, error
 
-        if value:
-            try:
-                value = datetime.strptime(value, '%d.%m.%Y').date()
-                from_date = datetime.now()
-                from_date -= relativedelta(years=70)
-                if value.year < from_date.year:
-                    raise ValidationError
-            except ValueError:
-                raise ValidationError(f'invalid date format: {value}')
+        if value.year < min_birthday_year():
+            # the error has always had no message
+            return value, ''
+        return value, None
 
 
 class GenderField(Field):
@@ -105,15 +150,16 @@ class GenderField(Field):
         super(GenderField, self).__init__(
             type=int, required=required, nullable=nullable)
 
-    def validate(self, value):
+    def clean(self, value):
         if not isinstance(value, self.type):
-            raise ValidationError('invalid value type of field "gender"')
+            return value, 'invalid value type of field "gender"'
 
         if not value and value != UNKNOWN and not self.nullable:
-            raise ValidationError('field "gender" cannot be empty')
+            return value, 'field "gender" cannot be empty'
 
         if value not in GENDERS:
-            raise ValidationError('invalid value of field "gender"')
+            return value, 'invalid value of field "gender"'
+        return value, None
 
 
 class ClientIDsField(Field):
@@ -121,10 +167,12 @@ class ClientIDsField(Field):
         super(ClientIDsField, self).__init__(
             type=(list, tuple), required=required, nullable=nullable)
 
-    def validate(self, value):
-        super(ClientIDsField, self).validate(value)
+    def clean(self, value):
+        value, error = super(ClientIDsField, self).clean(value)
+        if error is not None:
+            return value, error
 
-        if value:
-            for obj in value:
-                if not isinstance(obj, int) or obj < 0:
-                    raise ValidationError(f'invalid client id {value}')
+        for obj in value:
+            if not isinstance(obj, int) or obj < 0:
+                return value, f'invalid client id {value}'
+        return value, None
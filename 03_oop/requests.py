@@ -1,49 +1,57 @@
 from fields import Field, CharField, ArgumentsField, EmailField, BirthDayField, PhoneField, DateField, ClientIDsField, GenderField
 from consts import ADMIN_LOGIN
-from copy import deepcopy
 
 
-class Request():
+class Request(object):
+    """ Request body validated by a plan compiled once per class:
+    fields clean values to their types or return error messages,
+    which are accumulated """
+
+    __slots__ = ('_errors', '_initialized_fields', '_values')
+
     def __init_subclass__(cls):
         super().__init_subclass__()
 
-        declared_fields = []
+        cleaners = {}
         required_fields = []
 
         for attr_name, attr_value in cls.__dict__.items():
             if isinstance(attr_value, Field):
                 attr_value.name = attr_name
 
-                declared_fields.append(attr_name)
+                cleaners[attr_name] = attr_value.clean
 
                 if attr_value.required:
                     required_fields.append(attr_name)
 
-        cls._declared_fields = declared_fields
+        cls._cleaners = cleaners
+        cls._declared_fields = list(cleaners)
         cls._required_fields = required_fields
 
     def __init__(self, body):
-        self._errors = []
-        self._initialized_fields = []
-
-        body = deepcopy(body)
+        errors = self._errors = []
+        values = self._values = {}
+        cleaners = self._cleaners
 
         for field_name, field_value in body.items():
-            if field_name not in self._declared_fields:
-                self._errors.append(f'undeclared field {field_name}')
+            clean = cleaners.get(field_name)
+            if clean is None:
+                errors.append(f'undeclared field {field_name}')
                 continue
 
-            try:
-                setattr(self, field_name, field_value)
-            except Exception as e:
-                self._errors.append(str(e))
+            field_value, error = clean(field_value)
+            if error is not None:
+                errors.append(error)
                 continue
 
-            self._initialized_fields.append(field_name)
+            values[field_name] = field_value
+
+        self._initialized_fields = list(values)
 
-        missed = set(self._required_fields) - set(self._initialized_fields)
+        missed = [field_name for field_name in self._required_fields
+                  if field_name not in values]
         if missed:
-            self._errors.append(
+            errors.append(
                 'missing required fields: "{}"'.format(', '.join(missed)))
 
     @property
@@ -68,11 +76,15 @@ class Request():
 
 
 class ClientsInterestsRequest(Request):
+    __slots__ = ()
+
     client_ids = ClientIDsField(required=True)
     date = DateField(required=False, nullable=True)
 
 
 class OnlineScoreRequest(Request):
+    __slots__ = ()
+
     first_name = CharField(required=False, nullable=True)
     last_name = CharField(required=False, nullable=True)
     email = EmailField(required=False, nullable=True)
@@ -92,6 +104,8 @@ class OnlineScoreRequest(Request):
 
 
 class MethodRequest(Request):
+    __slots__ = ()
+
     account = CharField(required=False, nullable=True)
     login = CharField(required=True, nullable=True)
     token = CharField(required=True, nullable=True)
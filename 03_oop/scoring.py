@@ -1,7 +1,108 @@
+import json
+import time
+import logging
 import random
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+SCORE_CACHE_TIME = 60 * 60
+SCORE_CACHE_SIZE = 10000
+
+
+class ScoreCache(object):
+    """ In-process LRU cache of scores, at most size of them are kept
+    and each for ttl seconds. The store, if given, is the second tier
+    shared between processes """
+
+    def __init__(self, size=SCORE_CACHE_SIZE, ttl=SCORE_CACHE_TIME):
+        self.size = size
+        self.ttl = ttl
+        self.scores = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get(self, key, store=None):
+        """ Return cached score or None """
+
+        now = time.monotonic()
+        with self.lock:
+            cached = self.scores.get(key)
+            if cached is not None:
+                score, expires = cached
+                if expires > now:
+                    self.scores.move_to_end(key)
+                    self.hits += 1
+                    return score
+                del self.scores[key]
+
+        # store is a cache here, score is calculated if it's unavailable
+        score = store.cache_get(key) if store else None
+        if score is not None:
+            try:
+                score = float(score)
+            except (TypeError, ValueError):
+                logging.warning(f'Invalid score {score!r} of {key} in store')
+                score = None
+        if score is not None:
+            self.put(key, score)
+            with self.lock:
+                self.store_hits += 1
+            return score
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, score):
+        with self.lock:
+            self.scores[key] = (score, time.monotonic() + self.ttl)
+            self.scores.move_to_end(key)
+            if len(self.scores) > self.size:
+                self.scores.popitem(last=False)
+
+    def set(self, key, score, store=None):
+        self.put(key, score)
+        if store:
+            store.cache_set(key, score, self.ttl)
+
+    def clear(self):
+        with self.lock:
+            self.scores.clear()
+            self.hits = self.store_hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.scores), "hits": self.hits,
+                    "store_hits": self.store_hits, "misses": self.misses}
+
+
+score_cache = ScoreCache()
+
+
+def score_key(phone, email, birthday, gender, first_name, last_name):
+    """ Return stable cache key of all fields the score depends on """
+
+    key_parts = [
+        first_name,
+        last_name,
+        phone,
+        email,
+        birthday.strftime("%Y%m%d") if birthday else None,
+        gender,
+    ]
+    return "uid:" + hashlib.md5(json.dumps(key_parts).encode('utf-8')).hexdigest()
 
 
 def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = score_key(phone, email, birthday, gender, first_name, last_name)
+    score = score_cache.get(key, store)
+    if score is not None:
+        return score
+
     score = 0
     if phone:
         score += 1.5
@@ -11,9 +112,35 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
+
+    score_cache.set(key, score, store)
     return score
 
 
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
 def get_interests(store, cid):
-    interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
-    return random.sample(interests, 2)
+    if not store:
+        # no store configured, interests are made up
+        return random.sample(INTERESTS, 2)
+
+    r = store.get("i:%s" % cid)
+    return json.loads(r) if r else []
+
+
+def get_interests_many(store, cids):
+    """ Return ({cid: interests}, {cid: error}) read by one multi-get,
+    a client missing in store has no interests """
+
+    if not store:
+        return {cid: random.sample(INTERESTS, 2) for cid in cids}, {}
+
+    cids = list(dict.fromkeys(cids))
+    interests, errors = {}, {}
+    for cid, r in zip(cids, store.mget(["i:%s" % cid for cid in cids])):
+        try:
+            interests[cid] = json.loads(r) if r else []
+        except ValueError as e:
+            errors[cid] = f'invalid interests: {e}'
+    return interests, errors
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+
+from exceptions import StoreError
+
+
+TIMEOUT = 1
+RETRIES = 3
+BACKOFF = 0.05
+POOL_SIZE = 10
+# keys per MGET command, chunks are pipelined in one round-trip
+MGET_SIZE = 500
+
+
+class RedisConnection(object):
+    """ Key-value backend connection speaking Redis protocol (RESP),
+    every socket operation is limited by timeout """
+
+    def __init__(self, host, port, timeout=TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.file = self.sock.makefile('rb')
+
+    def execute(self, *args):
+        """ Send command and return its reply """
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """ Send all commands at once and return list of their replies """
+
+        data = []
+        for args in commands:
+            data.append(b'*%d\r\n' % len(args))
+            for arg in args:
+                arg = str(arg).encode('utf-8')
+                data.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(data))
+        return [self.read_reply() for _ in commands]
+
+    def read_reply(self):
+        line = self.file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('connection closed by store')
+        kind, data = line[:1], line[1:-2]
+
+        if kind == b'+':
+            return data.decode('utf-8')
+        if kind == b'-':
+            raise StoreError(data.decode('utf-8'))
+        if kind == b':':
+            return int(data)
+        if kind == b'$':
+            if int(data) < 0:
+                return None
+            value = self.file.read(int(data) + 2)
+            if len(value) != int(data) + 2:
+                raise ConnectionError('connection closed by store')
+            return value[:-2].decode('utf-8')
+        if kind == b'*':
+            if int(data) < 0:
+                return None
+            return [self.read_reply() for _ in range(int(data))]
+        raise ConnectionError(f'unexpected store reply {line!r}')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class ConnectionPool(object):
+    """ At most size connections made by connect(), idle ones are reused.
+    A connection which failed is closed instead of being returned """
+
+    def __init__(self, connect, size=POOL_SIZE):
+        self.connect = connect
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            raise StoreError('store connection pool is exhausted')
+        try:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self.connect()
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self.idle.put(connection)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Store(object):
+    """ Key-value store client. get must succeed and raises StoreError
+    when store is unavailable after retries, cache_get and cache_set are
+    best-effort: a failure is logged and treated as a cache miss """
+
+    def __init__(self, host='localhost', port=6379, timeout=TIMEOUT, retries=RETRIES,
+                 backoff=BACKOFF, pool_size=POOL_SIZE, connection_class=RedisConnection):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(
+            lambda: connection_class(host, port, timeout), pool_size)
+
+    def execute(self, *args, retries=None):
+        """ Return reply of command """
+        return self.pipeline([args], retries)[0]
+
+    def pipeline(self, commands, retries=None):
+        """ Return list of replies of commands sent in one round-trip,
+        connection errors and timeouts are retried with exponential backoff """
+
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                with self.pool.connection(self.timeout) as connection:
+                    return connection.pipeline(commands)
+            except OSError as e:
+                error = e
+                logging.warning(f'Store {commands[0][0]} failed, attempt {attempt + 1}: {e}')
+            if attempt < retries:
+                time.sleep(self.backoff * 2 ** attempt)
+
+        raise StoreError(f'store is unavailable: {error}') from error
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def mget(self, keys):
+        """ Return list of values of keys, None for missing ones """
+
+        if not keys:
+            return []
+        commands = [('MGET', *keys[i:i + MGET_SIZE])
+                    for i in range(0, len(keys), MGET_SIZE)]
+        return [value for values in self.pipeline(commands) for value in values]
+
+    def cache_get(self, key):
+        try:
+            return self.execute('GET', key, retries=0)
+        except StoreError as e:
+            logging.warning(f'Cache get of {key} failed: {e}')
+            return None
+
+    def cache_set(self, key, value, expire):
+        try:
+            self.execute('SET', key, value, 'EX', int(expire), retries=0)
+        except StoreError as e:
+            logging.warning(f'Cache set of {key} failed: {e}')
+
+    def close(self):
+        self.pool.close()
@@ -1,11 +1,26 @@
+import json
+import time
+import asyncio
 import hashlib
 import datetime
 import functools
+import threading
 import unittest
+import socket
+import socketserver
+import http.client
 from http import HTTPStatus
+from unittest import mock
 
 import api
+import async_api
 import consts
+import auth
+import fields
+import scoring
+import requests
+from store import Store
+from exceptions import StoreError
 
 def cases(cases):
     def decorator(f):
@@ -99,6 +114,51 @@ class TestSuite(unittest.TestCase):
         self.assertTrue(isinstance(score, (int, float)) and score >= 0, arguments)
         self.assertEqual(sorted(self.context["has"]), sorted(arguments.keys()))
 
+    @cases([
+        ({"first_name": "a", "last_name": "b"}, 0.5),
+        ({"phone": 79175002040, "email": "stupnikov@otus.ru"}, 3.0),
+        ({"gender": 1, "birthday": "01.01.2000", "first_name": "", "last_name": "b"}, 1.5),
+    ])
+    def test_score(self, arguments, score):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(HTTPStatus.OK, code, arguments)
+        self.assertEqual(score, response["score"], arguments)
+
+    def test_batch(self):
+        requests_ = [
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+             "arguments": {"client_ids": [1, 2]}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": {}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "token": "bad", "arguments": {}},
+            {"login": "h&f"},
+            "not a request",
+        ]
+        for request in requests_[:3]:
+            self.set_valid_auth(request)
+
+        with mock.patch("api.check_auth", wraps=api.check_auth) as check_auth:
+            response, code = api.batch_handler({"body": requests_, "headers": self.headers},
+                                               self.context, self.settings)
+        self.assertEqual(HTTPStatus.OK, code)
+        self.assertEqual([200, 200, 422, 403, 422, 422], [r["code"] for r in response])
+        self.assertEqual({"score": 3.0}, response[0]["response"])
+        self.assertEqual([1, 2], sorted(response[1]["response"]))
+        self.assertEqual("Forbidden", response[3]["error"])
+        # the same credentials are checked once
+        self.assertEqual(2, check_auth.call_count)
+        self.assertEqual(6, self.context["nitems"])
+
+    @cases([{}, {"account": "horns&hoofs"}, [{}] * (api.MAX_BATCH_SIZE + 1)])
+    def test_invalid_batch(self, body):
+        _, code = api.batch_handler({"body": body, "headers": self.headers},
+                                    self.context, self.settings)
+        self.assertEqual(HTTPStatus.UNPROCESSABLE_ENTITY, code)
+
     def test_ok_score_admin_request(self):
         arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
         request = {"account": "horns&hoofs", "login": "admin", "method": "online_score", "arguments": arguments}
@@ -139,5 +199,551 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
 
+class TestAuth(unittest.TestCase):
+    def setUp(self):
+        self.authenticator = auth.Authenticator(size=2)
+
+    def request(self, login, token, account="horns&hoofs"):
+        return requests.MethodRequest({"account": account, "login": login, "method": "m",
+                                       "token": token, "arguments": {}})
+
+    def user_token(self, login, account="horns&hoofs"):
+        return hashlib.sha512((account + login + consts.SALT).encode('utf-8')).hexdigest()
+
+    def admin_token(self, hour):
+        return hashlib.sha512((hour.strftime("%Y%m%d%H") + consts.ADMIN_SALT).encode('utf-8')).hexdigest()
+
+    def test_user(self):
+        with mock.patch("auth.user_digest", wraps=auth.user_digest) as user_digest:
+            self.assertFalse(self.authenticator.check(self.request("a", "bad")))
+            self.assertFalse(self.authenticator.check(self.request("a", None)))
+            self.assertTrue(self.authenticator.check(self.request("a", self.user_token("a"))))
+            self.assertTrue(self.authenticator.check(self.request("a", self.user_token("a"))))
+            self.assertFalse(self.authenticator.check(self.request("a", self.user_token("b"))))
+            # only the verified digest is cached
+            self.assertEqual(2, user_digest.call_count)
+
+            self.authenticator.check(self.request("b", self.user_token("b")))
+            self.authenticator.check(self.request("c", self.user_token("c")))
+            self.assertEqual(["b", "c"], [key[-1] for key in self.authenticator.users])
+
+    def test_admin(self):
+        hour = datetime.datetime(2020, 1, 1, 10)
+        with mock.patch("auth.datetime") as datetime_, mock.patch("auth.time") as time_:
+            datetime_.datetime.now.return_value = hour + datetime.timedelta(minutes=30)
+            datetime_.timedelta = datetime.timedelta
+            time_.time.return_value = hour.timestamp() + 1800
+
+            self.assertTrue(self.authenticator.check(self.request("admin", self.admin_token(hour))))
+            previous = hour - datetime.timedelta(hours=1)
+            self.assertTrue(self.authenticator.check(self.request("admin", self.admin_token(previous))))
+            self.assertFalse(self.authenticator.check(
+                self.request("admin", self.admin_token(previous - datetime.timedelta(hours=1)))))
+            self.assertFalse(self.authenticator.check(self.request("admin", self.user_token("admin"))))
+            self.assertEqual(1, datetime_.datetime.now.call_count)
+
+            # the next hour
+            next_hour = hour + datetime.timedelta(hours=1)
+            datetime_.datetime.now.return_value = next_hour
+            time_.time.return_value = next_hour.timestamp()
+            self.assertTrue(self.authenticator.check(self.request("admin", self.admin_token(next_hour))))
+            self.assertTrue(self.authenticator.check(self.request("admin", self.admin_token(hour))))
+            self.assertFalse(self.authenticator.check(self.request("admin", self.admin_token(previous))))
+
+
+class TestRequests(unittest.TestCase):
+    @cases([
+        ({"x": 1, "phone": "79175002040", "email": "a@b.c"}, ['undeclared field x']),
+        ({"phone": "89175002040", "email": "a@b.c"},
+         ['invalid phone number: 89175002040', 'invalid arguments set']),
+        ({"phone": [], "email": "abc"},
+         ["field phone, invalid type (<class 'int'>, <class 'str'>)",
+          'invalid email address: abc', 'invalid arguments set']),
+        ({"gender": 1, "birthday": "01.01.1890"}, ['', 'invalid arguments set']),
+        ({"gender": "1", "birthday": "2000.01.01"},
+         ['invalid value type of field "gender"', 'invalid date format: 2000.01.01',
+          'invalid arguments set']),
+    ])
+    def test_online_score_errors(self, body, errors):
+        self.assertEqual(errors, requests.OnlineScoreRequest(body).errors)
+
+    def test_missing_fields(self):
+        request = requests.MethodRequest({"account": "a", "method": ""})
+        self.assertEqual(['field method cannot be empty',
+                          'missing required fields: "login, token, arguments, method"'],
+                         request.errors)
+        self.assertEqual(["account"], request.initialized_fields)
+
+    def test_values(self):
+        body = {"client_ids": [1, 2], "date": "19.07.2017"}
+        request = requests.ClientsInterestsRequest(body)
+        self.assertTrue(request.is_valid)
+        self.assertEqual(["client_ids", "date"], request.initialized_fields)
+        self.assertEqual([1, 2], request.client_ids)
+        self.assertIsNone(requests.ClientsInterestsRequest({}).date)
+        self.assertFalse(hasattr(request, "__dict__"))
+
+    def test_typed_values(self):
+        request = requests.OnlineScoreRequest({"phone": 79175002040, "email": "a@b.c",
+                                               "birthday": "01.02.2000", "gender": 1})
+        self.assertTrue(request.is_valid)
+        self.assertEqual("79175002040", request.phone)
+        self.assertEqual(datetime.date(2000, 2, 1), request.birthday)
+
+    def test_min_birthday_year(self):
+        midnight = datetime.datetime(2020, 3, 1).timestamp()
+        with mock.patch("fields._age_limit", (0, None)), \
+                mock.patch("fields.date") as date, mock.patch("fields.time") as time_:
+            date.today.return_value = datetime.date(2020, 2, 29)
+            time_.time.return_value = midnight - 10
+            self.assertEqual(1950, fields.min_birthday_year())
+            # computed once a day
+            self.assertEqual(1950, fields.min_birthday_year())
+            self.assertEqual(1, date.today.call_count)
+
+            date.today.return_value = datetime.date(2020, 3, 1)
+            time_.time.return_value = midnight
+            self.assertEqual(1950, fields.min_birthday_year())
+            self.assertEqual(2, date.today.call_count)
+
+
+class TestPooledServer(unittest.TestCase):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+               "token": "", "arguments": {}}
+
+    def setUp(self):
+        self.server = api.PooledHTTPServer(("localhost", 0), api.KeepAliveHTTPHandler,
+                                           workers=2, max_connections=8,
+                                           keepalive_timeout=1)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connect(self):
+        return http.client.HTTPConnection(*self.server.server_address, timeout=5)
+
+    def post(self, connection, path, body):
+        connection.request("POST", path, body)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_keep_alive(self):
+        connection = self.connect()
+        for _ in range(3):
+            response, body = self.post(connection, "/method", json.dumps(self.request))
+            self.assertEqual(HTTPStatus.FORBIDDEN, response.status)
+            self.assertEqual(11, response.version)
+            self.assertEqual(len(body), int(response.headers["Content-Length"]))
+            self.assertEqual(HTTPStatus.FORBIDDEN, json.loads(body)["code"])
+            self.assertFalse(response.will_close)
+        connection.close()
+
+    def test_batch(self):
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + consts.SALT).encode('utf-8')).hexdigest()
+        request = dict(self.request, token=token, arguments={"first_name": "a", "last_name": "b"})
+        connection = self.connect()
+        response, body = self.post(connection, "/batch", json.dumps([request, self.request]))
+        self.assertEqual(HTTPStatus.OK, response.status)
+        self.assertEqual([{"code": 200, "response": {"score": 0.5}},
+                          {"code": 403, "error": "Forbidden"}], json.loads(body)["response"])
+        connection.close()
+
+    def test_empty_batch(self):
+        connection = self.connect()
+        response, body = self.post(connection, "/batch", "[]")
+        self.assertEqual(HTTPStatus.OK, response.status)
+        self.assertEqual({"response": [], "code": 200}, json.loads(body))
+        response, _ = self.post(connection, "/method", "{}")
+        self.assertEqual(HTTPStatus.UNPROCESSABLE_ENTITY, response.status)
+        connection.close()
+
+    def test_bad_request_closes_connection(self):
+        connection = self.connect()
+        response, body = self.post(connection, "/method", "{not json")
+        self.assertEqual(HTTPStatus.BAD_REQUEST, response.status)
+        self.assertTrue(response.will_close)
+        connection.close()
+
+    def test_concurrent_requests(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_handler(request, ctx, store):
+            started.set()
+            release.wait(5)
+            return {}, HTTPStatus.OK
+
+        with mock.patch.dict(api.MainHTTPHandler.router, {"slow": slow_handler}):
+            slow = self.connect()
+            slow_thread = threading.Thread(target=self.post, args=(slow, "/slow", '{"a": 1}'))
+            slow_thread.start()
+            self.assertTrue(started.wait(5))
+
+            # the slow request doesn't block other clients
+            response, _ = self.post(self.connect(), "/method", json.dumps(self.request))
+            self.assertEqual(HTTPStatus.FORBIDDEN, response.status)
+
+            release.set()
+            slow_thread.join()
+            slow.close()
+
+
+    def test_idle_connections(self):
+        idle = [self.connect() for _ in range(3)]
+        for connection in idle:
+            self.post(connection, "/method", json.dumps(self.request))
+        silent = [socket.create_connection(self.server.server_address, timeout=5)
+                  for _ in range(3)]
+
+        # idle keep-alive and silent connections don't hold the workers
+        started = time.monotonic()
+        response, _ = self.post(self.connect(), "/method", json.dumps(self.request))
+        self.assertEqual(HTTPStatus.FORBIDDEN, response.status)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        response, _ = self.post(idle[0], "/method", json.dumps(self.request))
+        self.assertEqual(HTTPStatus.FORBIDDEN, response.status)
+        self.assertFalse(response.will_close)
+
+        # and are closed after keepalive_timeout
+        for raw in silent:
+            self.assertEqual(b"", raw.recv(1))
+            raw.close()
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+        for connection in idle:
+            connection.close()
+
+class TestAsyncServer(unittest.IsolatedAsyncioTestCase):
+    request = json.dumps(TestPooledServer.request)
+
+    async def start(self, **kwargs):
+        self.server = async_api.AsyncHTTPServer(**kwargs)
+        self.asyncio_server = await self.server.start("localhost", 0)
+        self.address = self.asyncio_server.sockets[0].getsockname()[:2]
+
+    async def asyncTearDown(self):
+        self.asyncio_server.close()
+        await self.asyncio_server.wait_closed()
+        self.server.close()
+
+    async def post(self, connection, path, body, version="HTTP/1.1"):
+        reader, writer = connection
+        body = body.encode("utf-8")
+        writer.write(f"POST {path} {version}\r\nHost: localhost\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, _, headers = head.decode("latin-1").partition("\r\n")
+        headers = dict(line.split(": ", 1) for line in headers.strip().split("\r\n"))
+        data = json.loads(await reader.readexactly(int(headers["Content-Length"])))
+        return int(status_line.split()[1]), headers, data
+
+    async def test_keep_alive(self):
+        await self.start()
+        connection = await asyncio.open_connection(*self.address)
+        for _ in range(3):
+            status, headers, data = await self.post(connection, "/method", self.request)
+            self.assertEqual(HTTPStatus.FORBIDDEN, status)
+            self.assertEqual(HTTPStatus.FORBIDDEN, data["code"])
+            self.assertNotIn("Connection", headers)
+        connection[1].close()
+
+    async def test_close(self):
+        await self.start()
+        for body, path, version, code in (
+                ("{not json", "/method", "HTTP/1.1", HTTPStatus.BAD_REQUEST),
+                (self.request, "/method", "HTTP/1.0", HTTPStatus.FORBIDDEN)):
+            connection = await asyncio.open_connection(*self.address)
+            status, headers, data = await self.post(connection, path, body, version)
+            self.assertEqual(code, status)
+            self.assertEqual("close", headers["Connection"])
+            self.assertEqual(b"", await connection[0].read())
+            connection[1].close()
+
+    async def test_body_limits(self):
+        await self.start(max_body_size=len(self.request))
+        for head, code in ((f"Content-Length: {len(self.request) + 1}",
+                            HTTPStatus.REQUEST_ENTITY_TOO_LARGE),
+                           ("Content-Length: -1", HTTPStatus.BAD_REQUEST),
+                           ("Content-Length: many", HTTPStatus.BAD_REQUEST),
+                           ("Content-Type: application/json", HTTPStatus.BAD_REQUEST)):
+            reader, writer = await asyncio.open_connection(*self.address)
+            writer.write(f"POST /method HTTP/1.1\r\n{head}\r\n\r\n".encode("latin-1"))
+            status_line, _, headers = (await reader.read()).decode("latin-1").partition("\r\n")
+            self.assertEqual(code, int(status_line.split()[1]))
+            self.assertIn("Connection: close", headers)
+            writer.close()
+
+    async def test_body_timeout(self):
+        await self.start(keepalive_timeout=0.1)
+        reader, writer = await asyncio.open_connection(*self.address)
+        writer.write(f"POST /method HTTP/1.1\r\nContent-Length: {len(self.request)}"
+                     f"\r\n\r\n{self.request[:-1]}".encode("latin-1"))
+        # the body never completes, connection is closed without response
+        self.assertEqual(b"", await asyncio.wait_for(reader.read(), 5))
+        writer.close()
+
+    async def test_empty_batch(self):
+        await self.start()
+        connection = await asyncio.open_connection(*self.address)
+        status, _, data = await self.post(connection, "/batch", "[]")
+        self.assertEqual(HTTPStatus.OK, status)
+        self.assertEqual({"response": [], "code": 200}, data)
+        status, _, _ = await self.post(connection, "/method", "{}")
+        self.assertEqual(HTTPStatus.UNPROCESSABLE_ENTITY, status)
+        connection[1].close()
+
+    async def test_not_found(self):
+        await self.start()
+        connection = await asyncio.open_connection(*self.address)
+        status, _, data = await self.post(connection, "/unknown", self.request)
+        self.assertEqual(HTTPStatus.NOT_FOUND, status)
+        self.assertEqual("Not Found", data["error"])
+        connection[1].close()
+
+    async def test_request_timeout(self):
+        def slow_handler(request, ctx, store):
+            time.sleep(0.3)
+            return {}, HTTPStatus.OK
+
+        await self.start(workers=1, request_timeout=0.1)
+        with mock.patch.dict(api.MainHTTPHandler.router, {"slow": slow_handler}):
+            slow = await asyncio.open_connection(*self.address)
+            waiting = await asyncio.open_connection(*self.address)
+            results = await asyncio.gather(self.post(slow, "/slow", '{"a": 1}'),
+                                           self.post(waiting, "/slow", '{"a": 1}'))
+        self.assertEqual(HTTPStatus.GATEWAY_TIMEOUT, results[0][0])
+        # the only worker is still busy with the first request
+        self.assertEqual(HTTPStatus.SERVICE_UNAVAILABLE, results[1][0])
+        slow[1].close()
+        waiting[1].close()
+
+    async def test_max_connections(self):
+        await self.start(max_connections=1)
+        first = await asyncio.open_connection(*self.address)
+        status, _, _ = await self.post(first, "/method", self.request)
+        self.assertEqual(HTTPStatus.FORBIDDEN, status)
+
+        second = await asyncio.open_connection(*self.address)
+        self.assertEqual(b"", await second[0].read())
+        first[1].close()
+        second[1].close()
+
+
+class TestScoreCache(unittest.TestCase):
+    def test_lru(self):
+        cache = scoring.ScoreCache(size=2)
+        cache.set("a", 1.0)
+        cache.set("b", 2.0)
+        self.assertEqual(1.0, cache.get("a"))
+        cache.set("c", 3.0)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1.0, cache.get("a"))
+        self.assertEqual(3.0, cache.get("c"))
+        self.assertEqual({"size": 2, "hits": 3, "store_hits": 0, "misses": 1}, cache.stats())
+
+    def test_ttl(self):
+        cache = scoring.ScoreCache(ttl=60)
+        with mock.patch("scoring.time.monotonic", return_value=100):
+            cache.set("a", 1.0)
+        with mock.patch("scoring.time.monotonic", return_value=159):
+            self.assertEqual(1.0, cache.get("a"))
+        with mock.patch("scoring.time.monotonic", return_value=160):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.stats()["size"])
+
+    def test_score_key(self):
+        birthday = datetime.datetime(2000, 1, 1)
+        key = scoring.score_key("79175002040", "a@b.c", birthday, 1, "a", "b")
+        self.assertEqual(key, scoring.score_key("79175002040", "a@b.c", birthday, 1, "a", "b"))
+        self.assertNotEqual(key, scoring.score_key("79175002040", None, birthday, 1, "a", "b"))
+        self.assertNotEqual(key, scoring.score_key("79175002040", "a@b.c", birthday, None, "a", "b"))
+        self.assertNotEqual(key, scoring.score_key("79175002040", "a@b.c", birthday, 1, "ab", ""))
+        self.assertNotEqual(scoring.score_key(None, None, None, None, "a\0b", ""),
+                            scoring.score_key(None, None, None, None, "a", "b\0"))
+
+    def test_invalid_store_score(self):
+        cache = scoring.ScoreCache()
+        store = mock.Mock()
+        for score in ("not a number", b"\xff", []):
+            store.cache_get.return_value = score
+            self.assertIsNone(cache.get("a", store))
+        self.assertEqual({"size": 0, "hits": 0, "store_hits": 0, "misses": 3}, cache.stats())
+
+    def test_get_score(self):
+        scoring.score_cache.clear()
+        self.assertEqual(3.0, scoring.get_score(None, "79175002040", "a@b.c"))
+        self.assertEqual(3.0, scoring.get_score(None, "79175002040", "a@b.c"))
+        self.assertEqual(1.5, scoring.get_score(None, "79175002040", None))
+        self.assertEqual({"size": 2, "hits": 1, "store_hits": 0, "misses": 2},
+                         scoring.score_cache.stats())
+
+
+class StubStoreHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+            self.server.commands.append(args)
+
+            if self.server.drop:
+                self.server.drop -= 1
+                return
+            time.sleep(self.server.delay)
+            self.wfile.write(self.server.reply(args))
+
+
+class StubStoreServer(socketserver.ThreadingTCPServer):
+    """ Stand-in key-value store speaking a subset of Redis protocol,
+    drop closes that many next connections instead of replying """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), StubStoreHandler)
+        self.data = {}
+        self.commands = []
+        self.connections = 0
+        self.drop = 0
+        self.delay = 0
+
+    @staticmethod
+    def bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        value = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def reply(self, args):
+        command = args[0].upper()
+        if command == "GET":
+            return self.bulk(self.data.get(args[1]))
+        if command == "SET":
+            self.data[args[1]] = args[2]
+            return b"+OK\r\n"
+        if command == "MGET":
+            return b"*%d\r\n" % (len(args) - 1) + \
+                b"".join(self.bulk(self.data.get(key)) for key in args[1:])
+        return b"-ERR unknown command\r\n"
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.server = StubStoreServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.store = Store(*self.server.server_address, timeout=0.2, retries=2, backoff=0.01)
+        scoring.score_cache.clear()
+
+    def tearDown(self):
+        self.store.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_set(self):
+        self.store.cache_set("key", "value", 60)
+        self.assertEqual(["SET", "key", "value", "EX", "60"], self.server.commands[0])
+        self.assertEqual("value", self.store.get("key"))
+        self.assertEqual("value", self.store.cache_get("key"))
+        self.assertIsNone(self.store.get("missing"))
+        # the connection is reused
+        self.assertEqual(1, self.server.connections)
+
+    def test_retry(self):
+        self.server.data["key"] = "value"
+        self.server.drop = 2
+        self.assertEqual("value", self.store.get("key"))
+
+        self.server.drop = 3
+        with self.assertRaises(StoreError):
+            self.store.get("key")
+
+        # cache isn't retried
+        self.server.drop = 1
+        self.assertIsNone(self.store.cache_get("key"))
+        self.assertEqual("value", self.store.cache_get("key"))
+
+    def test_timeout(self):
+        self.server.data["key"] = "value"
+        self.server.delay = 0.5
+
+        started = time.monotonic()
+        self.assertIsNone(self.store.cache_get("key"))
+        self.assertLess(time.monotonic() - started, 0.5)
+        with self.assertRaises(StoreError):
+            self.store.get("key")
+
+    def test_unavailable(self):
+        with socket.socket() as sock:
+            sock.bind(("localhost", 0))
+            address = sock.getsockname()
+        store = Store(*address, timeout=0.2, retries=1, backoff=0.01)
+
+        self.assertIsNone(store.cache_get("key"))
+        store.cache_set("key", "value", 60)
+        with self.assertRaises(StoreError):
+            store.get("key")
+
+    def test_get_score(self):
+        score = scoring.get_score(self.store, "79175002040", "stupnikov@otus.ru")
+        self.assertEqual(3.0, score)
+        key, = self.server.data
+        self.assertTrue(key.startswith("uid:"))
+
+        self.assertEqual(3.0, scoring.get_score(self.store, "79175002040", "stupnikov@otus.ru"))
+        self.assertEqual(2, len(self.server.commands))
+
+        # another process has cached the score
+        scoring.score_cache.clear()
+        self.server.data[key] = "5"
+        self.assertEqual(5.0, scoring.get_score(self.store, "79175002040", "stupnikov@otus.ru"))
+        self.assertEqual({"size": 1, "hits": 0, "store_hits": 1, "misses": 0},
+                         scoring.score_cache.stats())
+
+    def test_get_interests(self):
+        self.server.data["i:1"] = json.dumps(["cars", "pets"])
+        self.assertEqual(["cars", "pets"], scoring.get_interests(self.store, 1))
+        self.assertEqual([], scoring.get_interests(self.store, 2))
+
+        self.server.drop = 3
+        with self.assertRaises(StoreError):
+            scoring.get_interests(self.store, 1)
+
+    def test_mget(self):
+        self.server.data.update({"a": "1", "c": "3", "d": "4"})
+        with mock.patch("store.MGET_SIZE", 2):
+            self.assertEqual(["1", None, "3", "4", None], self.store.mget(["a", "b", "c", "d", "e"]))
+        # three MGET commands are sent in one round-trip
+        self.assertEqual([["MGET", "a", "b"], ["MGET", "c", "d"], ["MGET", "e"]],
+                         self.server.commands)
+        self.assertEqual([], self.store.mget([]))
+
+    def test_get_interests_many(self):
+        self.server.data.update({"i:1": json.dumps(["cars"]), "i:3": "not json"})
+        interests, errors = scoring.get_interests_many(self.store, [1, 2, 3, 1])
+        self.assertEqual({1: ["cars"], 2: []}, interests)
+        self.assertEqual([3], list(errors))
+        self.assertEqual([["MGET", "i:1", "i:2", "i:3"]], self.server.commands)
+
+    def test_clients_interests_handler(self):
+        self.server.data.update({"i:1": json.dumps(["cars"]), "i:3": "not json"})
+        response, code = api.clients_interests_handler({"client_ids": [1, 2, 3]}, {}, self.store)
+        self.assertEqual(HTTPStatus.OK, code)
+        self.assertEqual(["cars"], response[1])
+        self.assertEqual([], response[2])
+        self.assertIn("error", response[3])
+
+        self.server.drop = 3
+        response, code = api.clients_interests_handler({"client_ids": [1, 2, 3]}, {}, self.store)
+        self.assertEqual(HTTPStatus.UNPROCESSABLE_ENTITY, code)
+
+
 if __name__ == "__main__":
     unittest.main()